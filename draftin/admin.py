@@ -1,17 +1,25 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Count
 from django.urls import reverse
 
-from .models import Draft, Collection, Publication
+from .jobs import enqueue
+from .models import Draft, Collection, Publication, Job
 
 
 @admin.register(Collection)
 class CollectionAdmin(admin.ModelAdmin):
     list_display = ['name','uuid', 'parent', 'auto_publish', "drafts", "webhook"]
 
+    def get_queryset(self, request):
+        qs = super(CollectionAdmin, self).get_queryset(request)
+        return qs.annotate(draft_count=Count("draft")).prefetch_related("parent")
+
     def drafts(self, instance=None):
         if instance:
-            return instance.draft_set.count()
+            return instance.draft_count
         return ""
+    drafts.admin_order_field = "draft_count"
 
     def webhook(self, instance=None):
         if instance:
@@ -25,13 +33,25 @@ class PublicationAdmin(admin.ModelAdmin):
     model = Publication
 
 
+class DraftChangeList(ChangeList):
+    """
+    The list view never shows the body, so don't load it.
+    """
+
+    def get_queryset(self, request):
+        qs = super(DraftChangeList, self).get_queryset(request)
+        return qs.for_listing().defer("description")
+
+
 @admin.register(Draft)
 class DraftAdmin(admin.ModelAdmin):
     model = Draft
     list_display = ["name", "origin", "collection", 
         "created_at", "updated_at", "published",]
+    list_select_related = ["collection"]
     list_filter = ["published", "collection"]
     ordering = ["-updated_at", ]
+    actions = ["rescrape"]
     readonly_fields = ["content", "content_html", 
         "draftin_user_id", "draftin_user_email", "origin"]
     fieldsets = (
@@ -57,13 +77,33 @@ class DraftAdmin(admin.ModelAdmin):
     def origin(self, instance):
         if instance.draft_id:
             return "Draftin"
-        elif instance.external_url and instance.publication:
+        elif instance.external_url and instance.publication_id:
             return "External Link"
         elif instance.external_url:
             return "Markdown scrape"
         return "Unknown"
 
+    def get_changelist(self, request, **kwargs):
+        return DraftChangeList
+
+    def rescrape(self, request, queryset):
+        drafts = queryset.exclude(external_url="")
+        for draft in drafts:
+            enqueue(draft, Job.SCRAPE)
+        self.message_user(request, "Queued %s drafts to re-scrape." % len(drafts))
+    rescrape.short_description = "Re-scrape the external url"
+
     def save_model(self, request, obj, form, change):
         if not obj.draftin_user_email:
             obj.draftin_user_email = request.user.email
         super(DraftAdmin, self).save_model(request, obj, form, change)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    model = Job
+    list_display = ["draft", "kind", "status", "attempts", "run_after", "updated_at"]
+    list_filter = ["status", "kind"]
+    list_select_related = ["draft"]
+    raw_id_fields = ["draft"]
+    readonly_fields = ["attempts", "leased_until", "last_error"]
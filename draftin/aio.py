@@ -0,0 +1,179 @@
+"""
+The sync pipeline's network stages on an event loop.
+
+Content, gists and images are fetched with one shared httpx
+AsyncClient, so a single thread can have many syncs in flight.
+Database work and image resizing still run synchronously, through
+the loop's thread pool. Needs httpx.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import weakref
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import close_old_connections
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from .helpers import GIST_API_URL, gist_data_to_markdown
+from .images import IMAGE_CHUNK_SIZE, accept_image, finish_image, temp_image
+from .settings import DRAFTIN_SETTINGS
+from .stats import timed
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def run_sync(func, *args, **kwargs):
+    """
+    Run blocking code (the ORM, PIL) in the loop's thread pool.
+
+    Nothing closes the database connections those threads open, the
+    way request_finished does for views, so each call closes its
+    thread's connection when it's done with it (or past CONN_MAX_AGE).
+    """
+    def call():
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(None, call)
+
+
+def get_client():
+    """
+    The AsyncClient shared by everything on the running loop.
+    """
+    if httpx is None:
+        raise ImproperlyConfigured("draftin's async pipeline requires httpx.")
+    loop = asyncio.get_event_loop()
+    client = _clients.get(loop)
+    if client is None:
+        limit = DRAFTIN_SETTINGS["ASYNC_MAX_CONNECTIONS"]
+        client = _clients[loop] = httpx.AsyncClient(
+            timeout=DRAFTIN_SETTINGS["HTTP_TIMEOUT"],
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=limit,
+                max_keepalive_connections=limit))
+    return client
+
+
+async def close_client():
+    client = _clients.pop(asyncio.get_event_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def gather_limited(func, items, limit):
+    """
+    Like pool.map(func, items), with at most `limit` running at once.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(item):
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*[run(item) for item in items])
+
+
+async def fetch_gist(gist_id, etag=""):
+    """
+    helpers.fetch_gist(), on the event loop.
+    """
+    headers = {"If-None-Match": etag} if etag else {}
+    try:
+        api_resp = await get_client().get(GIST_API_URL % gist_id, headers=headers)
+        if api_resp.status_code == 304:
+            return etag, None
+        api_resp.raise_for_status()
+        data = json.loads(api_resp.content.decode("utf-8"))
+    except httpx.HTTPError:
+        return None
+    return api_resp.headers.get("ETag", ""), gist_data_to_markdown(data)
+
+
+async def store_image(src):
+    """
+    images.store_image(), on the event loop.
+    """
+    max_bytes = DRAFTIN_SETTINGS["MAX_IMAGE_BYTES"]
+    temp_path = None
+    try:
+        async with get_client().stream("GET", src) as resp:
+            if not resp.is_success:
+                return None
+            extension = accept_image(resp.headers)
+            if extension is None:
+                return None
+
+            sha = hashlib.sha256()
+            size = 0
+            with temp_image(extension) as f:
+                temp_path = f.name
+                async for chunk in resp.aiter_bytes(IMAGE_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        break
+                    sha.update(chunk)
+                    f.write(chunk)
+
+        return await run_sync(finish_image, temp_path, sha, size, extension)
+    except (httpx.HTTPError, httpx.InvalidURL):
+        return None
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+async def download_gists(draft):
+    gist_ids, cached = await run_sync(draft.gists_to_fetch)
+    if not gist_ids:
+        return
+
+    async def fetch(gist_id):
+        gist = cached.get(gist_id)
+        return await fetch_gist(gist_id, gist.etag if gist else "")
+
+    with timed("gists", items=len(gist_ids)):
+        results = await gather_limited(fetch, gist_ids,
+            DRAFTIN_SETTINGS["GIST_FETCH_CONCURRENCY"])
+        await run_sync(draft.apply_gists, gist_ids, cached, results)
+
+
+async def download_images(draft):
+    with timed("images") as stage:
+        tree, sources, assets, missing = await run_sync(draft.images_to_fetch)
+        stage.items = len(missing)
+        stored = await gather_limited(store_image, missing,
+            DRAFTIN_SETTINGS["IMAGE_FETCH_CONCURRENCY"])
+        await run_sync(draft.apply_images, tree, sources, assets, missing, stored)
+
+
+async def download_content(draft):
+    """
+    Draft.download_content(), on the event loop.
+    """
+    url, headers, revalidate = draft.content_request()
+    with timed("fetch") as stage:
+        try:
+            resp = await get_client().get(url, headers=headers)
+            if resp.status_code != 304:
+                resp.raise_for_status()
+        except httpx.HTTPError:
+            raise ValidationError("External url failed to scrape.")
+        stage.bytes = len(resp.content)
+    if not draft.apply_content(resp, revalidate):
+        return False
+
+    await download_gists(draft)
+    await run_sync(draft.render_html)
+    await download_images(draft)
+    return True
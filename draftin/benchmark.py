@@ -0,0 +1,367 @@
+"""
+Offline benchmarks for the sync pipeline, run by `manage.py draftin_benchmark`.
+
+FakeUpstream serves Dropbox files, the GitHub gists API and images
+from a local HTTP server with configurable latency, so every stage
+can be measured without the network and compared against a baseline.
+"""
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+    import urlparse
+except ImportError:
+    from urllib import parse as urlparse
+
+import requests
+from PIL import Image
+
+from django.test import RequestFactory
+
+from . import helpers, rendering, stats
+from .models import Collection, Draft, ImageAsset
+from .views import endpoint
+
+FAKE_HOSTS = ["dl.dropbox.com", "www.dropbox.com", "api.github.com", "images.example.com"]
+
+# Imported only by syncs (except lxml, which rendering fragments and
+# webhooks need); a process that just reads drafts shouldn't load them.
+HEAVY_MODULES = ["requests", "urllib3", "lxml", "markdown", "mistune",
+    "markdown_it", "PIL", "httpx"]
+
+# Run in a fresh interpreter by bench_startup().
+STARTUP_SCRIPT = """
+import json, resource, sys, time
+
+def peak_rss_kb():
+    # ru_maxrss survives exec() on Linux, so it would report the parent's
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+start = time.perf_counter()
+import django
+django.setup()
+for name in sys.argv[2:]:
+    __import__(name)
+exec(sys.argv[1])
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "max_rss_kb": peak_rss_kb(),
+    "modules": len(sys.modules),
+    "heavy": sorted(name for name in %r if name in sys.modules),
+}))
+""" % (HEAVY_MODULES,)
+
+WORDS = ("the quick brown fox jumps over a lazy dog while writers keep "
+    "drafting long form essays about markdown gists images and code").split()
+
+
+class LocalAdapter(requests.adapters.HTTPAdapter):
+    """
+    Send every request to the fake server, keeping its path.
+    """
+
+    def __init__(self, base_url, **kwargs):
+        self.base_url = base_url
+        super(LocalAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urlparse.urlsplit(request.url)
+        request.url = urlparse.urlunsplit(("http", self.base_url, parts.path, parts.query, ""))
+        return super(LocalAdapter, self).send(request, **kwargs)
+
+
+class FakeUpstream(object):
+    """
+    A local stand-in for dl.dropbox.com, api.github.com/gists
+    and image hosts. Use as a context manager; while it's running,
+    the shared sessions in draftin.helpers point at it.
+    """
+
+    def __init__(self, latency=0.0, image_size=(1600, 1200)):
+        self.latency = latency
+        self.documents = {}
+        self.requests = 0
+        buf = io.BytesIO()
+        Image.new("RGB", image_size, (120, 80, 40)).save(buf, "JPEG", quality=90)
+        self.image = buf.getvalue()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.saved_sessions = None
+
+    @property
+    def base_url(self):
+        return "%s:%s" % self.server.server_address
+
+    def add_document(self, path, text):
+        self.documents[path] = text.encode("utf-8")
+
+    def handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                upstream.requests += 1
+                if upstream.latency:
+                    time.sleep(upstream.latency)
+                path = urlparse.urlsplit(self.path).path
+                if path.startswith("/gists/"):
+                    gist_id = path.rsplit("/", 1)[-1]
+                    body = json.dumps({"files": {"%s.py" % gist_id: {
+                        "language": "Python",
+                        "content": "def gist_%s():\n    return %r\n" % (gist_id, gist_id),
+                    }}}).encode("utf-8")
+                    return self.respond(body, "application/json", '"gist-%s"' % gist_id)
+                if path.startswith("/img/"):
+                    # Decoders ignore bytes after the end of a JPEG, so this
+                    # gives every url distinct content for the store to hash.
+                    body = upstream.image + path.encode("utf-8")
+                    return self.respond(body, "image/jpeg")
+                if path in upstream.documents:
+                    body = upstream.documents[path]
+                    return self.respond(body, "text/plain; charset=utf-8",
+                        '"%s"' % hashlib.sha1(body).hexdigest())
+                self.respond(b"Not found", "text/plain", status=404)
+
+            def respond(self, body, content_type, etag=None, status=200):
+                if etag and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.saved_sessions = dict(helpers._sessions)
+        adapter = LocalAdapter(self.base_url, pool_maxsize=32)
+        for host in FAKE_HOSTS:
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            helpers._sessions[host] = session
+        return self
+
+    def __exit__(self, *exc_info):
+        helpers._sessions.clear()
+        helpers._sessions.update(self.saved_sessions)
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def synthetic_document(words, gists=0, images=0, seed=0):
+    """
+    Markdown of roughly `words` words, with headings, fenced code,
+    footnotes, embedded gists and images spread through it.
+    """
+    rand = random.Random(seed)
+    blocks = []
+    written = 0
+    extras = ["gist"] * gists + ["image"] * images
+    every = max(1, words // 60 // (len(extras) + 1))
+
+    def embed(extra):
+        if extra == "gist":
+            return '<script src="https://gist.github.com/bench/%s%s.js"></script>' % (
+                seed, len(blocks))
+        return "![Image](https://images.example.com/img/%s-%s.jpg)" % (seed, len(blocks))
+
+    while written < words:
+        n = rand.randint(40, 80)
+        blocks.append(" ".join(rand.choice(WORDS) for _ in range(n)))
+        written += n
+        if len(blocks) % 7 == 0:
+            blocks.append("## Section %s" % len(blocks))
+        if len(blocks) % 11 == 0:
+            blocks.append("```python\nprint(%s)\n```" % len(blocks))
+        if len(blocks) % 13 == 0:
+            blocks[-1] += " A note.[^%s]" % len(blocks)
+            blocks.append("[^%s]: The footnote." % len(blocks))
+        if extras and len(blocks) % every == 0:
+            blocks.append(embed(extras.pop()))
+    while extras:
+        blocks.append(embed(extras.pop()))
+    return "\n\n".join(blocks) + "\n"
+
+
+def timeit(func, repeat=1):
+    """
+    The best of `repeat` runs of func(), in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_webhook(count):
+    """
+    Webhook requests per second, for new drafts, for redeliveries,
+    and for edits to drafts we already have.
+    """
+    collection = Collection.objects.create(name="Webhook benchmark")
+    factory = RequestFactory()
+
+    def payload(i, version):
+        return json.dumps({
+            "id": i, "name": "Draft %s" % i,
+            "content": synthetic_document(500, seed=i * 2 + version),
+            "content_html": "<p>Draft %s, version %s</p>" % (i, version),
+            "user": {"id": 1, "email": "bench@example.com"},
+            "created_at": "2013-05-23T14:11:54",
+            "updated_at": "2013-05-23T14:11:5%s" % (8 + version),
+        })
+
+    originals = [payload(i, 0) for i in range(count)]
+    edits = [payload(i, 1) for i in range(count)]
+
+    def post(body):
+        request = factory.post("/", body, content_type="application/json")
+        response = endpoint(request, collection.uuid)
+        assert response.status_code == 200, response.content
+
+    created = timeit(lambda: [post(body) for body in originals])
+    redelivered = timeit(lambda: [post(body) for body in originals])
+    updated = timeit(lambda: [post(body) for body in edits])
+    return {
+        "new_per_second": count / created,
+        "redelivered_per_second": count / redelivered,
+        "updated_per_second": count / updated,
+    }
+
+
+def bench_content(upstream, sizes, gists, images, repeat):
+    """
+    download_content latency for documents of increasing size, cold
+    and then warm (unchanged upstream), with a per-stage breakdown.
+    """
+    collection = Collection.objects.create(name="Content benchmark")
+    memory = stats.MemoryBackend()
+    saved_backends, stats._backends = stats._backends, [memory]
+    results = []
+    try:
+        for words in sizes:
+            path = "/s/bench/%s.md" % words
+            upstream.add_document(path, synthetic_document(words, gists, images, seed=words))
+            draft = Draft(collection=collection, name="Bench %s" % words,
+                external_url="https://dl.dropbox.com" + path)
+            memory.reset()
+            cold = timeit(draft.download_content)
+            stages = memory.summary()
+            warm = timeit(draft.download_content, repeat)
+            results.append({
+                "words": words,
+                "cold_seconds": cold,
+                "warm_seconds": warm,
+                "stages": {stage: totals["duration"] for stage, totals in stages.items()},
+            })
+    finally:
+        stats._backends = saved_backends
+    return results
+
+
+def bench_images(count):
+    """
+    Peak Python allocations and max RSS while storing `count` images.
+    """
+    collection = Collection.objects.create(name="Image benchmark")
+    draft = Draft(collection=collection, name="Images")
+    draft.content = "\n\n".join(
+        "![Image](https://images.example.com/img/mem-%s.jpg)" % i for i in range(count))
+    draft.render_html()
+    ImageAsset.objects.all().delete()
+
+    tracemalloc.start()
+    seconds = timeit(draft.download_images)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "images": count,
+        # Responsive copies made; 0 means make_variants() didn't run
+        "variants": sum(len(asset.get_variants()) for asset in ImageAsset.objects.all()),
+        "seconds": seconds,
+        "peak_traced_bytes": peak,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def bench_render(sizes, repeat):
+    """
+    Markdown render time, uncached and through the render cache.
+    """
+    results = []
+    for words in sizes:
+        text = synthetic_document(words, seed=words)
+        rendering.render_markdown(text)
+        results.append({
+            "words": words,
+            "uncached_seconds": timeit(lambda: rendering.convert_markdown(text), repeat),
+            "cached_seconds": timeit(lambda: rendering.render_markdown(text), repeat),
+        })
+    return results
+
+
+# What a web worker does without syncing: render a fragment for a
+# template, and post-process a webhook's html (see views.endpoint).
+RENDER_SCRIPT = """
+from draftin.fragments import build_fragment
+from draftin.models import Draft
+from draftin.transforms import transform_html
+build_fragment(Draft(content_html='<h2>Title</h2><p>Some text.</p>'))
+transform_html('<h2>Title</h2><p>Some <img src="a.png"> text.</p>')
+"""
+
+
+def bench_startup(repeat):
+    """
+    Time, max RSS and modules loaded by a fresh process that sets up
+    Django and imports what a web worker does, then renders a fragment
+    and a webhook's html, and then imports the pipeline.
+    """
+    def run(modules, script):
+        output = subprocess.check_output(
+            [sys.executable, "-c", STARTUP_SCRIPT, script] + modules,
+            env=os.environ.copy())
+        return json.loads(output.decode("utf-8"))
+
+    web = ["draftin.models", "draftin.admin", "draftin.urls"]
+    results = {}
+    for name, modules, script in [
+            ("web", web, ""),
+            ("render", web, RENDER_SCRIPT),
+            ("sync", web + ["draftin.pipeline"], "")]:
+        runs = [run(modules, script) for _ in range(repeat)]
+        best = min(runs, key=lambda result: result["seconds"])
+        results[name] = best
+    return results
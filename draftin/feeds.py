@@ -0,0 +1,192 @@
+"""
+Atom and JSON feeds of the published drafts in a Collection or
+Publication.
+
+Feeds are built from one limited query (without the markdown source)
+and cached whole, with their ETag and Last-Modified, until a draft in
+them is saved. A poll that hits the cache doesn't touch the database,
+and one that sends back a matching validator gets a 304.
+"""
+import hashlib
+import json
+
+from django.core.cache import caches
+from django.utils import feedgenerator
+from django.utils.module_loading import import_string
+
+from .fragments import get_fragment
+from .settings import DRAFTIN_SETTINGS
+
+CONTENT_TYPES = {
+    "atom": "application/atom+xml; charset=utf-8",
+    "json": "application/feed+json; charset=utf-8",
+}
+
+
+class WithoutLinks(object):
+    """
+    Passes xml through to a handler, leaving out <link>s with no href.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def __getattr__(self, name):
+        return getattr(self.handler, name)
+
+    def addQuickElement(self, name, contents=None, attrs=None):
+        if name == "link" and attrs and attrs.get("href") is None:
+            return
+        self.handler.addQuickElement(name, contents, attrs)
+
+
+class AtomFeed(feedgenerator.Atom1Feed):
+    """
+    Atom with each draft's full html as <content>, and no
+    <link> for drafts that don't live anywhere.
+    """
+
+    def add_item_elements(self, handler, item):
+        if item["link"] is None:
+            handler = WithoutLinks(handler)
+        super(AtomFeed, self).add_item_elements(handler, item)
+        if item.get("content"):
+            handler.addQuickElement("content", item["content"], {"type": "html"})
+
+
+def draft_link(draft):
+    """
+    Where a draft lives on the site: its get_absolute_url() (e.g. from
+    ABSOLUTE_URL_OVERRIDES), or else its canonical or external url.
+    """
+    if hasattr(draft, "get_absolute_url"):
+        return draft.get_absolute_url()
+    return draft.canonical_url or draft.external_url
+
+
+def feed_cache_key(kind, pk, format):
+    return "draftin:feed:%s:%s:%s" % (kind, pk, format)
+
+
+def invalidate_feeds(draft):
+    """
+    Drop the cached feeds a draft appears in.
+    """
+    alias = DRAFTIN_SETTINGS["FEED_CACHE"]
+    if not alias:
+        return
+    keys = [feed_cache_key("collection", draft.collection_id, format)
+        for format in CONTENT_TYPES]
+    if draft.publication_id:
+        keys += [feed_cache_key("publication", draft.publication_id, format)
+            for format in CONTENT_TYPES]
+    caches[alias].delete_many(keys)
+
+
+def feed_items(request, drafts):
+    link = import_string(DRAFTIN_SETTINGS["FEED_LINK"])
+    items = []
+    for draft in drafts:
+        fragment = get_fragment(draft)
+        url = link(draft)
+        items.append({
+            "id": "urn:draftin:draft:%s" % draft.pk,
+            "title": draft.name,
+            "link": request.build_absolute_uri(url) if url else None,
+            "summary": fragment["excerpt"],
+            "content": fragment["html"],
+            "published": draft.date_published or draft.created_at,
+            "updated": draft.updated_at,
+        })
+    return items
+
+
+def feed_url(request):
+    """
+    The feed's own url, without the query string, which
+    shouldn't end up in a feed that's cached for everyone.
+    """
+    return request.build_absolute_uri(request.path)
+
+
+def write_atom(request, title, items):
+    feed = AtomFeed(title=title, link=request.build_absolute_uri("/"),
+        description="", feed_url=feed_url(request))
+    for item in items:
+        feed.add_item(title=item["title"], link=item["link"],
+            description=item["summary"], content=item["content"],
+            unique_id=item["id"], pubdate=item["published"],
+            updateddate=item["updated"])
+    return feed.writeString("utf-8")
+
+
+def json_item(item):
+    data = {
+        "id": item["id"],
+        "url": item["link"],
+        "title": item["title"],
+        "summary": item["summary"],
+        "content_html": item["content"],
+        "date_published": item["published"].isoformat(),
+        "date_modified": item["updated"].isoformat(),
+    }
+    if data["url"] is None:
+        del data["url"]
+    return data
+
+
+def write_json(request, title, items):
+    return json.dumps({
+        "version": "https://jsonfeed.org/version/1.1",
+        "title": title,
+        "home_page_url": request.build_absolute_uri("/"),
+        "feed_url": feed_url(request),
+        "items": [json_item(item) for item in items],
+    })
+
+
+WRITERS = {"atom": write_atom, "json": write_json}
+
+
+def build_feed(request, title, drafts, format):
+    """
+    The feed's body, with the validators to serve it with.
+    """
+    drafts = list(drafts.published().defer("content")[
+        :DRAFTIN_SETTINGS["FEED_ITEMS"]])
+    body = WRITERS[format](request, title, feed_items(request, drafts))
+    updated = [draft.updated_at for draft in drafts if draft.updated_at]
+    return {
+        "body": body,
+        "content_type": CONTENT_TYPES[format],
+        "etag": '"%s"' % hashlib.sha1(body.encode("utf-8")).hexdigest(),
+        "last_modified": max(updated) if updated else None,
+    }
+
+
+def get_feed(request, kind, pk, format, build):
+    """
+    The cached feed, or build(), cached. Memoized on the request,
+    since the conditional checks and the view all need it.
+
+    Feeds hold absolute urls, so one is cached for each scheme and
+    host it's requested on, all under the one key invalidate_feeds()
+    deletes. Hosts are limited to ALLOWED_HOSTS by get_host().
+    """
+    key = feed_cache_key(kind, pk, format)
+    memo = getattr(request, "_draftin_feeds", None)
+    if memo is None:
+        memo = request._draftin_feeds = {}
+    if key in memo:
+        return memo[key]
+
+    alias = DRAFTIN_SETTINGS["FEED_CACHE"]
+    origin = "%s://%s" % (request.scheme, request.get_host())
+    origins = (caches[alias].get(key) if alias else None) or {}
+    feed = origins.get(origin)
+    if feed is None:
+        feed = origins[origin] = build()
+        if alias:
+            caches[alias].set(key, origins, DRAFTIN_SETTINGS["FEED_CACHE_TIMEOUT"])
+    memo[key] = feed
+    return feed
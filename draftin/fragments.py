@@ -0,0 +1,109 @@
+"""
+What templates need from a draft (its html, an excerpt, its headings),
+worked out once and cached under a key versioned by the draft's pk and
+updated_at, which Draft.save moves forward whenever the content changes.
+
+    {% load draftin_tags %}
+    {% draftin_render draft %}
+    {% draftin_fragment draft as fragment %}{{ fragment.excerpt }}
+
+The same version makes an ETag, so views can answer conditional requests
+without loading the content:
+
+    @condition(etag_func=lambda request, slug: draft_etag(
+        Draft.objects.only("pk", "updated_at").get(slug=slug)))
+"""
+from django.core.cache import caches
+from django.utils.safestring import mark_safe
+from django.utils.text import Truncator
+
+from .settings import DRAFTIN_SETTINGS
+
+# Bump when build_fragment() changes, to retire cached fragments.
+FRAGMENT_VERSION = 1
+
+
+def draft_version(draft, updated_at=None):
+    """
+    The draft's pk and updated_at (or the updated_at passed),
+    which needn't be a datetime yet if it was set by hand.
+    """
+    if updated_at is None:
+        updated_at = draft.updated_at
+    if hasattr(updated_at, "strftime"):
+        stamp = updated_at.strftime("%Y%m%d%H%M%S%f")
+    else:
+        stamp = updated_at or ""
+    return "%s.%s.%s" % (draft.pk, stamp, FRAGMENT_VERSION)
+
+
+def fragment_cache_key(draft, updated_at=None):
+    return "draftin:fragment:%s" % draft_version(draft, updated_at)
+
+
+def draft_etag(draft):
+    return '"%s"' % draft_version(draft)
+
+
+def draft_last_modified(draft):
+    return draft.updated_at
+
+
+def build_fragment(draft):
+    """
+    The html of a draft, an excerpt (its description, or the start
+    of its first paragraph) and its headings, for a table of contents.
+    """
+    excerpt = draft.description
+    headings = []
+    if draft.content_html:
+        from .transforms import HEADINGS, parse_html
+        tree = parse_html(draft.content_html)
+        if not excerpt:
+            for p in tree.iter("p"):
+                text = p.text_content().strip()
+                if text:
+                    excerpt = Truncator(text).words(DRAFTIN_SETTINGS["EXCERPT_WORDS"])
+                    break
+        for heading in tree.iter(*HEADINGS):
+            headings.append({
+                "level": int(heading.tag[1]),
+                "id": heading.get("id", ""),
+                "text": heading.text_content().strip(),
+            })
+    return {"html": draft.content_html, "excerpt": excerpt, "headings": headings}
+
+
+def get_fragment(draft):
+    """
+    build_fragment(), through the cache.
+    """
+    alias = DRAFTIN_SETTINGS["FRAGMENT_CACHE"]
+    if not alias or draft.pk is None:
+        fragment = build_fragment(draft)
+    else:
+        key = fragment_cache_key(draft)
+        fragment = caches[alias].get(key)
+        if fragment is None:
+            fragment = build_fragment(draft)
+            caches[alias].set(key, fragment, DRAFTIN_SETTINGS["FRAGMENT_CACHE_TIMEOUT"])
+    fragment["html"] = mark_safe(fragment["html"])
+    return fragment
+
+
+def render_draft(draft):
+    """
+    The draft's html, safe to put in a template.
+    """
+    return get_fragment(draft)["html"]
+
+
+def invalidate_draft(draft):
+    """
+    Drop the cached fragment for the draft as it was last loaded or saved,
+    whatever its updated_at has been set to since.
+    """
+    alias = DRAFTIN_SETTINGS["FRAGMENT_CACHE"]
+    if alias and draft.pk is not None:
+        updated_at = getattr(draft, "_loaded_updated_at", None)
+        caches[alias].delete(fragment_cache_key(draft, updated_at))
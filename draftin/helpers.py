@@ -1,5 +1,14 @@
+import re
 import json
-import requests
+import hashlib
+import threading
+
+try:
+    import urlparse
+except ImportError:
+    from urllib import parse as urlparse
+
+from .settings import DRAFTIN_SETTINGS
 
 GIST_TEMPALTE = """
 ```%(language)s
@@ -7,26 +16,83 @@ GIST_TEMPALTE = """
 ```
 """
 
-def gist_to_markdown(gist_id):
+GIST_API_URL = "https://api.github.com/gists/%s"
+
+TAG_RE = re.compile(r"<[^>]*>")
+WORD_RE = re.compile(r"\S+")
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url):
     """
-    Get markdown fenced code from an embedded gist.
+    Get a shared requests session for the url's host, so repeat
+    requests to the same server reuse pooled keep-alive connections.
+    """
+    import requests
+
+    host = urlparse.urlparse(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            pool_size = max(DRAFTIN_SETTINGS["IMAGE_FETCH_CONCURRENCY"],
+                DRAFTIN_SETTINGS["GIST_FETCH_CONCURRENCY"])
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[host] = session
+    return session
+
+
+def gist_data_to_markdown(data):
+    """
+    Convert a gist API response to markdown fenced code.
     """
-    api_resp = requests.get("https://api.github.com/gists/%s" % gist_id)
-    try:
-        api_resp.raise_for_status()
-    except Exception:
-        return None
-    data = json.loads(api_resp.content.decode("utf-8"))
     markdown_reps = []
     for f in data["files"].values():
         md = GIST_TEMPALTE % {
-            "language": f["language"].lower(),
+            "language": (f["language"] or "").lower(),
             "content": f["content"],
         }
         markdown_reps.append(md)
     return "\n\n".join(markdown_reps)
 
 
+def fetch_gist(gist_id, etag=""):
+    """
+    Fetch a gist as markdown, revalidating with If-None-Match
+    when an ETag from an earlier fetch is passed.
+
+    Returns (etag, markdown), where markdown is None if the
+    gist hasn't changed, or None if the request fails.
+    """
+    url = GIST_API_URL % gist_id
+    headers = {"If-None-Match": etag} if etag else {}
+    try:
+        api_resp = get_session(url).get(url, headers=headers,
+            timeout=DRAFTIN_SETTINGS["HTTP_TIMEOUT"])
+        if api_resp.status_code == 304:
+            return etag, None
+        api_resp.raise_for_status()
+        data = json.loads(api_resp.content.decode("utf-8"))
+    except Exception:
+        return None
+    return api_resp.headers.get("ETag", ""), gist_data_to_markdown(data)
+
+
+def gist_to_markdown(gist_id):
+    """
+    Get markdown fenced code from an embedded gist.
+    """
+    result = fetch_gist(gist_id)
+    if result:
+        return result[1]
+    return None
+
+
 def dropbox_url(url):
     """
     Convert dropbox share url to a file url
@@ -34,3 +100,35 @@ def dropbox_url(url):
     if url.startswith("https://www.dropbox.com"):
         url = url.replace("https://www.dropbox.com", "https://dl.dropbox.com", 1)
     return url
+
+
+def replace_urls(text, urls):
+    """
+    Replace each key of `urls` in text with its value, in one pass.
+    """
+    if not urls:
+        return text
+    # Longest first, so a url that prefixes another doesn't win
+    pattern = re.compile("|".join(re.escape(url)
+        for url in sorted(urls, key=len, reverse=True)))
+    return pattern.sub(lambda match: urls[match.group()], text)
+
+
+def payload_digest(data):
+    """
+    A stable digest of a webhook payload, to detect redeliveries.
+    """
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def html_to_text(html):
+    """
+    Cheaply drop tags from html, leaving whitespace between
+    blocks so words on either side aren't run together.
+    """
+    return TAG_RE.sub(" ", html)
+
+
+def count_words(text):
+    return sum(1 for _ in WORD_RE.finditer(text))
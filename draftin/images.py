@@ -0,0 +1,196 @@
+import os
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import requests
+
+from django.conf import settings
+
+from .helpers import get_session
+from .resize import build_variants, resize_image
+from .settings import DRAFTIN_SETTINGS
+from .stats import timed
+
+IMAGE_DIR = "draftin/img"
+IMAGE_CHUNK_SIZE = 64 * 1024
+IMAGE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/svg+xml": ".svg",
+}
+
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+# Whether RESIZE_PROCESSES=None means a pool here. draftin_worker turns
+# it on; web processes (syncing through the admin) resize inline rather
+# than spawning a process per core each.
+resize_in_pool = False
+
+
+def get_pool():
+    """
+    The process pool images are resized in, started on first use,
+    or None to resize in the calling thread. Workers are spawned rather
+    than forked, so they don't inherit the web process's threads
+    and database connections. They don't see settings changed at
+    runtime either, so functions run in them take everything they
+    need as arguments.
+    """
+    global _pool, _pool_slots
+    processes = DRAFTIN_SETTINGS["RESIZE_PROCESSES"]
+    if processes is None:
+        processes = (os.cpu_count() or 1) if resize_in_pool else 0
+    if processes == 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"))
+            _pool_slots = threading.BoundedSemaphore(processes * 2)
+    return _pool
+
+
+def process_image(func, *args):
+    """
+    Run an image function in the process pool and wait for the
+    result. Callers are fetch threads, so several images are
+    decoded at once on separate cores, and the semaphore bounds
+    how many can queue up.
+    """
+    pool = get_pool()
+    if pool is None:
+        return func(*args)
+    with _pool_slots:
+        return pool.submit(func, *args).result()
+
+
+def make_variants(path):
+    """
+    Make the responsive copies of a stored image (path is
+    relative to MEDIA_ROOT) in the process pool: one per
+    IMAGE_WIDTHS narrower than the image, plus full and narrow
+    copies in IMAGE_FORMATS.
+
+    Returns [{"path", "width", "type"}], starting with the image
+    itself, [] if it isn't a raster format we resize, or None if
+    it can't be read, so it's tried again later. Copies already
+    on disk are reused, not rebuilt.
+    """
+    return process_image(build_variants, settings.MEDIA_ROOT, path,
+        DRAFTIN_SETTINGS["IMAGE_WIDTHS"], DRAFTIN_SETTINGS["IMAGE_FORMATS"],
+        settings.FILE_UPLOAD_PERMISSIONS)
+
+
+def image_extension(headers):
+    """
+    Pick a file extension for a downloaded image.
+    """
+    filename = headers.get("x-file-name")
+    if filename and os.path.splitext(filename)[1]:
+        return os.path.splitext(filename)[1].lower()
+    content_type = headers.get("content-type", "").split(";")[0].strip()
+    return IMAGE_EXTENSIONS.get(content_type, ".jpg")
+
+
+def accept_image(headers):
+    """
+    The extension to store an image response under, or None if
+    it isn't an image or says it's bigger than MAX_IMAGE_BYTES.
+    """
+    if not headers.get("content-type", "").startswith("image/"):
+        return None
+    if int(headers.get("content-length") or 0) > DRAFTIN_SETTINGS["MAX_IMAGE_BYTES"]:
+        return None
+    return image_extension(headers)
+
+
+def temp_image(extension):
+    """
+    A temp file to download into, next to the store so
+    it can be moved into place atomically.
+    """
+    directory = os.path.join(settings.MEDIA_ROOT, IMAGE_DIR)
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=directory, suffix=extension, delete=False)
+
+
+def store_image(src):
+    """
+    Download an image into the content-addressed store, and
+    return (digest, path, variants) or None if it can't be fetched.
+
+    Files are named by a hash of their bytes, so an image used
+    in several drafts, or under several urls, is stored once.
+    The body is streamed to a temp file and moved into place,
+    so memory use doesn't grow with the size of the image.
+    """
+    max_bytes = DRAFTIN_SETTINGS["MAX_IMAGE_BYTES"]
+    temp_path = None
+    try:
+        resp = get_session(src).get(src, stream=True,
+            timeout=DRAFTIN_SETTINGS["HTTP_TIMEOUT"])
+        with resp:
+            if not resp.ok:
+                return None
+            extension = accept_image(resp.headers)
+            if extension is None:
+                return None
+
+            sha = hashlib.sha256()
+            size = 0
+            with temp_image(extension) as f:
+                temp_path = f.name
+                for chunk in resp.iter_content(IMAGE_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        break
+                    sha.update(chunk)
+                    f.write(chunk)
+
+        return finish_image(temp_path, sha, size, extension)
+    except requests.RequestException:
+        # A bad url or a dropped connection loses this image, not the draft
+        return None
+    finally:
+        # finish_image() moves the file away; anything left is a failed download
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def finish_image(temp_path, sha, size, extension):
+    """
+    Resize a downloaded temp file and move it to its place in the
+    store, unless the same bytes are already there. Returns
+    (digest, path, variants), or None if the download was cut off.
+    """
+    try:
+        if size > DRAFTIN_SETTINGS["MAX_IMAGE_BYTES"] or not size:
+            return None
+
+        digest = sha.hexdigest()
+        path = os.path.join(IMAGE_DIR, digest[:2], digest + extension)
+        file_path = os.path.join(settings.MEDIA_ROOT, path)
+
+        # If this item exists, skip it
+        if os.path.exists(file_path) and os.path.getsize(file_path):
+            return digest, path, make_variants(path)
+
+        # Resize image, then move it into place
+        with timed("resize", bytes=size, items=1):
+            process_image(resize_image, temp_path, DRAFTIN_SETTINGS["MAX_IMAGE_SIZE"])
+        os.chmod(temp_path, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(temp_path, file_path)
+        return digest, path, make_variants(path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
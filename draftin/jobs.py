@@ -0,0 +1,186 @@
+import datetime
+import traceback
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Draft, Job
+from .settings import DRAFTIN_SETTINGS
+
+
+def enqueue(draft, kind):
+    """
+    Queue background work for a draft, unless the same
+    work is already waiting to run.
+    """
+    job = Job.objects.filter(draft=draft, kind=kind, status=Job.PENDING).first()
+    if job:
+        return job
+    return Job.objects.create(draft=draft, kind=kind)
+
+
+def _runnable(now):
+    """
+    Pending jobs that are due, plus running jobs whose
+    worker let the lease expire (e.g. it was killed).
+    """
+    return (Q(status=Job.PENDING, run_after__lte=now) |
+        Q(status=Job.RUNNING, leased_until__lt=now))
+
+
+def lease_job():
+    """
+    Claim the next runnable job, or return None.
+
+    Claiming is a conditional UPDATE, so two workers racing
+    for the same row can't both win, on any database.
+    """
+    now = timezone.now()
+    lease = datetime.timedelta(seconds=DRAFTIN_SETTINGS["JOB_LEASE_SECONDS"])
+    candidates = Job.objects.filter(_runnable(now)).order_by(
+        "run_after", "id").values_list("id", flat=True)[:10]
+    for job_id in candidates:
+        claimed = Job.objects.filter(_runnable(now), pk=job_id).update(
+            status=Job.RUNNING,
+            leased_until=now + lease,
+            attempts=F("attempts") + 1)
+        if claimed:
+            return Job.objects.select_related("draft").get(pk=job_id)
+    return None
+
+
+def started_from(draft):
+    """
+    What a job's result depends on, to check before saving it.
+    """
+    return draft.payload_digest, draft.content
+
+
+def save_result(draft, started, update_fields=None):
+    """
+    Save what a job made of the draft, unless the draft changed since the
+    job loaded it (e.g. a webhook delivered a new version). Then the result
+    is stale and is dropped; the job the change queued will redo it.
+    """
+    with transaction.atomic():
+        current = Draft.objects.select_for_update().only(
+            "payload_digest", "content").get(pk=draft.pk)
+        if started_from(current) != started:
+            return False
+        draft.save(update_fields=update_fields)
+    return True
+
+
+def run_images(draft):
+    started = started_from(draft)
+    draft.download_images()
+    save_result(draft, started, ["content", "content_html"])
+
+
+def run_gists(draft):
+    started = started_from(draft)
+    draft.download_gists()
+    draft.render_html()
+    draft.download_images()
+    save_result(draft, started, ["content", "content_html"])
+
+
+# What download_content() writes, so a scrape doesn't revert admin
+# edits made while it ran (save() adds wordcount and updated_at).
+SCRAPE_FIELDS = ["content", "content_html", "source_etag",
+    "source_last_modified", "source_digest"]
+
+
+def run_scrape(draft):
+    started = started_from(draft)
+    draft.download_content()
+    save_result(draft, started, SCRAPE_FIELDS)
+
+
+HANDLERS = {
+    Job.IMAGES: run_images,
+    Job.GISTS: run_gists,
+    Job.SCRAPE: run_scrape,
+}
+
+
+async def arun_images(draft):
+    from . import aio
+    started = started_from(draft)
+    await aio.download_images(draft)
+    await aio.run_sync(save_result, draft, started, ["content", "content_html"])
+
+
+async def arun_gists(draft):
+    from . import aio
+    started = started_from(draft)
+    await aio.download_gists(draft)
+    await aio.run_sync(draft.render_html)
+    await aio.download_images(draft)
+    await aio.run_sync(save_result, draft, started, ["content", "content_html"])
+
+
+async def arun_scrape(draft):
+    from . import aio
+    started = started_from(draft)
+    await aio.download_content(draft)
+    await aio.run_sync(save_result, draft, started, SCRAPE_FIELDS)
+
+
+ASYNC_HANDLERS = {
+    Job.IMAGES: arun_images,
+    Job.GISTS: arun_gists,
+    Job.SCRAPE: arun_scrape,
+}
+
+
+def run_job(job):
+    """
+    Run a leased job and record the outcome.
+    """
+    try:
+        HANDLERS[job.kind](job.draft)
+    except Exception:
+        return finish_job(job, traceback.format_exc())
+    return finish_job(job)
+
+
+async def arun_job(job):
+    """
+    run_job(), with the network on the event loop.
+    """
+    from . import aio
+    try:
+        await ASYNC_HANDLERS[job.kind](job.draft)
+    except Exception:
+        return await aio.run_sync(finish_job, job, traceback.format_exc())
+    return await aio.run_sync(finish_job, job)
+
+
+def finish_job(job, error=None):
+    """
+    Record how a job went. Failures are retried with
+    exponential backoff until JOB_MAX_ATTEMPTS.
+
+    Like lease_job(), the write is a conditional UPDATE: if this
+    worker's lease expired and another worker leased the job again,
+    that worker owns the outcome, and nothing is written.
+    """
+    if error:
+        job.last_error = error
+        if job.attempts >= DRAFTIN_SETTINGS["JOB_MAX_ATTEMPTS"]:
+            job.status = Job.FAILED
+        else:
+            delay = DRAFTIN_SETTINGS["JOB_RETRY_DELAY"] * 2 ** (job.attempts - 1)
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + datetime.timedelta(seconds=delay)
+    else:
+        job.status = Job.DONE
+        job.last_error = ""
+    leased_until, job.leased_until = job.leased_until, None
+    job.updated_at = timezone.now()
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING,
+        leased_until=leased_until).update(status=job.status, run_after=job.run_after,
+        leased_until=None, last_error=job.last_error, updated_at=job.updated_at)
+    return job
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from draftin.models import Draft
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored wordcount and reading time of every draft."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        drafts = Draft.objects.only("pk", "content", "content_html",
+            "wordcount", "reading_time").order_by("pk")
+        updated = 0
+        batch = []
+        for draft in drafts.iterator(chunk_size=options["batch_size"]):
+            counts = (draft.wordcount, draft.reading_time)
+            draft.count_words()
+            if counts != (draft.wordcount, draft.reading_time):
+                batch.append(draft)
+            if len(batch) >= options["batch_size"]:
+                updated += self.update(batch)
+                batch = []
+        updated += self.update(batch)
+        self.stdout.write("Updated %s drafts" % updated)
+
+    def update(self, batch):
+        # update() rather than save(), so post_save handlers don't fire
+        with transaction.atomic():
+            for draft in batch:
+                Draft.objects.filter(pk=draft.pk).update(
+                    wordcount=draft.wordcount, reading_time=draft.reading_time)
+        return len(batch)
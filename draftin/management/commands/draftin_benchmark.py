@@ -0,0 +1,96 @@
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from draftin.benchmark import (FakeUpstream, bench_content, bench_images,
+    bench_render, bench_startup, bench_webhook)
+
+
+def int_list(value):
+    return [int(part) for part in value.split(",") if part]
+
+
+class Command(BaseCommand):
+    help = ("Benchmark webhooks, syncs, image storage and rendering "
+        "against a local fake upstream and a throwaway database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--latency", type=float, default=20,
+            help="Milliseconds the fake upstream waits before each response.")
+        parser.add_argument("--sizes", type=int_list, default=[500, 5000, 50000],
+            help="Comma separated document sizes, in words.")
+        parser.add_argument("--gists", type=int, default=5,
+            help="Gists embedded in each document.")
+        parser.add_argument("--images", type=int, default=10,
+            help="Images embedded in each document.")
+        parser.add_argument("--image-size", type=int_list, default=[1600, 1200],
+            help="Width,height of the images the fake upstream serves.")
+        parser.add_argument("--webhooks", type=int, default=200,
+            help="Webhook requests to send.")
+        parser.add_argument("--repeat", type=int, default=3,
+            help="Runs of each warm measurement; the best one is reported.")
+        parser.add_argument("--json", action="store_true",
+            help="Print the results as JSON, to compare against a baseline.")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        media_root = tempfile.mkdtemp(prefix="draftin-benchmark-")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+        else:
+            self.report(results)
+
+    def run(self, options):
+        results = {"webhook": bench_webhook(options["webhooks"])}
+        upstream = FakeUpstream(latency=options["latency"] / 1000.0,
+            image_size=tuple(options["image_size"]))
+        with upstream:
+            results["content"] = bench_content(upstream, options["sizes"],
+                options["gists"], options["images"], options["repeat"])
+            results["images"] = bench_images(options["images"])
+        results["render"] = bench_render(options["sizes"], options["repeat"])
+        results["startup"] = bench_startup(options["repeat"])
+        return results
+
+    def report(self, results):
+        webhook = results["webhook"]
+        self.stdout.write("Webhook: %.0f new/s, %.0f redelivered/s, %.0f updated/s" % (
+            webhook["new_per_second"], webhook["redelivered_per_second"],
+            webhook["updated_per_second"]))
+
+        self.stdout.write("\nSync (download_content):")
+        for row in results["content"]:
+            stages = ", ".join("%s %.1fms" % (stage, seconds * 1000)
+                for stage, seconds in sorted(row["stages"].items()))
+            self.stdout.write("  %7s words: cold %.1fms, warm %.1fms (%s)" % (
+                row["words"], row["cold_seconds"] * 1000,
+                row["warm_seconds"] * 1000, stages))
+
+        images = results["images"]
+        self.stdout.write("\nImages: %s (%s copies) in %.1fms, peak %.1fMB traced, max RSS %.1fMB" % (
+            images["images"], images["variants"], images["seconds"] * 1000,
+            images["peak_traced_bytes"] / 1048576.0, images["max_rss_kb"] / 1024.0))
+
+        self.stdout.write("\nRender:")
+        for row in results["render"]:
+            self.stdout.write("  %7s words: uncached %.1fms, cached %.3fms" % (
+                row["words"], row["uncached_seconds"] * 1000,
+                row["cached_seconds"] * 1000))
+
+        self.stdout.write("\nStartup:")
+        for name, row in sorted(results["startup"].items()):
+            self.stdout.write("  %7s: %.1fms, max RSS %.1fMB, %s modules, heavy: %s" % (
+                name, row["seconds"] * 1000, row["max_rss_kb"] / 1024.0,
+                row["modules"], ", ".join(row["heavy"]) or "none"))
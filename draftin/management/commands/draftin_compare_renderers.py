@@ -0,0 +1,121 @@
+import difflib
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from lxml import etree, html
+
+from draftin.helpers import gist_data_to_markdown
+from draftin.models import Draft
+from draftin.rendering import split_blocks
+from draftin.settings import DRAFTIN_SETTINGS
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Documents every renderer has to agree on, after normalize_html().
+CORPUS = [
+    ("paragraphs", "A paragraph with *emphasis*, **strong** and `code`.\n\n"
+        "A second one with a [link](https://example.com/ \"Title\") and an\n"
+        "![image](https://example.com/a.png)."),
+    ("headings", "# One\n\n## Two\n\nText.\n\n### Three\n"),
+    ("lists", "* one\n* two\n* three\n\nThen in order:\n\n1. first\n2. second\n"),
+    ("loose list", "* one\n\n* two, with\n\n    a second paragraph\n\n* three\n"),
+    ("nested list", "1. one\n\n    * inner\n    * inner\n\n2. two\n\nAfter.\n"),
+    ("blockquote", "> Quoted text\n> over two lines.\n\nAfter.\n"),
+    ("inline html", "Text with <abbr title=\"HyperText\">HTML</abbr>.\n\n"
+        "<div class=\"aside\">A block of html.</div>\n"),
+    ("escaping", "5 < 6 & 7 > 3, and AT&T.\n"),
+    ("fenced code", "Before.\n\n```python\ndef f(x):\n    return x < 1 and \"<b>\"\n```\n\nAfter.\n"),
+    ("fenced code without a language", "```\n<script>alert(1)</script>\n```\n"),
+    ("indented code", "Text.\n\n    indented = True\n    print(indented)\n"),
+    ("footnotes", "A claim.[^1] Another.[^note]\n\n[^1]: The first note.\n"
+        "[^note]: A *named* note.\n"),
+    ("footnote referenced twice", "Once.[^a] Twice.[^a]\n\n[^a]: Shared.\n"),
+    ("gist", "Intro.\n\n" + gist_data_to_markdown({"files": {
+        "hello.py": {"language": "Python", "content": "print('<hello>')\n"},
+        "README": {"language": None, "content": "plain text & more"},
+    }}) + "\n\nOutro.\n"),
+    ("horizontal rule", "Above.\n\n---\n\nBelow.\n"),
+]
+
+
+def normalize_html(source):
+    """
+    Html with insignificant differences (whitespace between tags,
+    attribute order, entity spelling) taken out, one tag per line.
+    """
+    root = html.fragment_fromstring(source, create_parent="div")
+    for el in root.iter():
+        in_pre = el.tag == "pre" or any(parent.tag == "pre" for parent in el.iterancestors())
+        if el.text is not None and not in_pre:
+            el.text = WHITESPACE_RE.sub(" ", el.text).strip() or None
+        if el.tail is not None and not (in_pre and el.tag != "pre"):
+            el.tail = WHITESPACE_RE.sub(" ", el.tail).strip() or None
+        attrib = sorted(el.attrib.items())
+        el.attrib.clear()
+        el.attrib.update(attrib)
+    serialized = etree.tostring(root, encoding="unicode", method="html")
+    return re.sub(r"(<[^/][^>]*>|</[^>]+>)", r"\n\1", serialized).strip()
+
+
+class Command(BaseCommand):
+    help = ("Check that markdown renderers produce the same html as the "
+        "configured one, on a built-in corpus and optionally your drafts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("renderers", nargs="+",
+            help="Dotted paths of renderers to check, e.g. draftin.rendering.MistuneRenderer.")
+        parser.add_argument("--baseline", default=DRAFTIN_SETTINGS["RENDERER"],
+            help="Renderer the others are compared against (default: the configured one).")
+        parser.add_argument("--drafts", type=int, default=0,
+            help="Also compare the content of this many drafts.")
+
+    def handle(self, *args, **options):
+        documents = list(CORPUS)
+        drafts = Draft.objects.exclude(content="").order_by("-pk")
+        for draft in drafts.only("pk", "content")[:options["drafts"]]:
+            documents.append(("draft %s" % draft.pk, draft.content))
+
+        baseline = import_string(options["baseline"])()
+        expected = {name: normalize_html(baseline.convert(text)) for name, text in documents}
+
+        failures = 0
+        for path in options["renderers"]:
+            renderer = import_string(path)()
+            renderer.convert("")
+            actual = {}
+            elapsed = 0.0
+            for name, text in documents:
+                start = time.perf_counter()
+                actual[name] = normalize_html(renderer.convert(text))
+                elapsed += time.perf_counter() - start
+            failures += self.compare(baseline.name, expected, renderer.name, actual,
+                " (%.1fms)" % (elapsed * 1000))
+
+            # What render_blocks() would produce, were nothing cached.
+            actual = {}
+            for name, text in documents:
+                blocks = split_blocks(text)
+                if blocks:
+                    actual[name] = normalize_html("\n".join(
+                        renderer.convert(block).strip() for block in blocks))
+            failures += self.compare(baseline.name, expected,
+                "%s by blocks" % renderer.name, actual)
+
+        if failures:
+            raise CommandError("%s documents render differently." % failures)
+
+    def compare(self, expected_label, expected, label, actual, note=""):
+        mismatches = 0
+        for name, html in actual.items():
+            if html == expected[name]:
+                continue
+            mismatches += 1
+            self.stdout.write("%s differs on %s:" % (label, name))
+            diff = difflib.unified_diff(expected[name].splitlines(),
+                html.splitlines(), expected_label, label, lineterm="")
+            self.stdout.write("\n".join(diff) + "\n")
+        self.stdout.write("%s: %s of %s documents match%s" % (
+            label, len(actual) - mismatches, len(actual), note))
+        return mismatches
@@ -0,0 +1,36 @@
+import io
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from draftin.models import Draft
+
+from .draftin_import import FIELDS
+
+
+class Command(BaseCommand):
+    help = "Stream drafts out as JSONL, in the format draftin_import reads."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--collection", default=None,
+            help="Only export drafts in the Collection with this uuid.")
+        parser.add_argument("--output", default=None,
+            help="File to write to (default: stdout).")
+
+    def handle(self, *args, **options):
+        drafts = Draft.objects.order_by("pk")
+        if options["collection"]:
+            drafts = drafts.filter(collection__uuid=options["collection"])
+
+        out = sys.stdout
+        if options["output"]:
+            out = io.open(options["output"], "w", encoding="utf-8")
+        try:
+            for values in drafts.values(*FIELDS).iterator(chunk_size=500):
+                out.write(json.dumps(values, cls=DjangoJSONEncoder))
+                out.write("\n")
+        finally:
+            if out is not sys.stdout:
+                out.close()
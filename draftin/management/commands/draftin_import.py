@@ -0,0 +1,170 @@
+import datetime
+import io
+import json
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+
+from draftin.models import Collection, Draft
+from draftin.rendering import convert_markdown
+from draftin.transforms import transform_html
+
+FIELDS = ["name", "slug", "description", "content", "content_html",
+    "external_url", "canonical_url", "draft_id", "published", "date_published"]
+
+
+def read_directory(path):
+    """
+    Yield a document for each markdown file in a directory. The
+    title is the first `# ` heading, or else the file name.
+    """
+    for filename in sorted(os.listdir(path)):
+        stem, extension = os.path.splitext(filename)
+        if extension.lower() not in (".md", ".markdown"):
+            continue
+        with io.open(os.path.join(path, filename), encoding="utf-8") as f:
+            content = f.read()
+        name = stem
+        for line in content.splitlines():
+            if line.startswith("# "):
+                name = line[2:].strip()
+                break
+        yield {"name": name, "content": content}
+
+
+def read_jsonl(path):
+    """
+    Yield a document for each line of a JSONL file.
+    """
+    with io.open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def render(content, content_html):
+    """
+    The html of a document, rendered from its markdown unless
+    it came with some, with the transformers run over it.
+    """
+    return transform_html(content_html or convert_markdown(content))
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = "Bulk import markdown documents from a directory or a JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("source",
+            help="A directory of .md files, or a JSONL file of drafts.")
+        parser.add_argument("--collection", required=True,
+            help="uuid of the Collection to import into.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--processes", type=int, default=None,
+            help="Processes to render markdown with (default: one per core).")
+
+    def handle(self, *args, **options):
+        try:
+            collection = Collection.objects.get(uuid=options["collection"])
+        except Collection.DoesNotExist:
+            raise CommandError("No collection with uuid %s" % options["collection"])
+
+        source = options["source"]
+        if os.path.isdir(source):
+            documents = read_directory(source)
+        elif os.path.isfile(source):
+            documents = read_jsonl(source)
+        else:
+            raise CommandError("%s does not exist" % source)
+
+        self.taken_slugs = set()
+        self.taken_draft_ids = set()
+        total = skipped = 0
+        with ProcessPoolExecutor(max_workers=options["processes"]) as pool:
+            for batch in batches(documents, options["batch_size"]):
+                for document in batch:
+                    if not document.get("name") or "content" not in document:
+                        raise CommandError("Every document needs a name and content.")
+                new = self.new_documents(batch, collection)
+                skipped += len(batch) - len(new)
+                drafts = self.build_drafts(new, collection, pool)
+                Draft.objects.bulk_create(drafts, batch_size=options["batch_size"])
+                total += len(drafts)
+                self.stdout.write("Imported %s drafts" % total)
+        if skipped:
+            self.stdout.write("Skipped %s drafts whose draft_id was already "
+                "imported" % skipped)
+
+    def new_documents(self, batch, collection):
+        """
+        The documents whose draft_id isn't in the collection or earlier
+        in the import, checked with one query per batch, so a re-run or
+        a repeated id skips them rather than failing part way through.
+        """
+        draft_ids = set(document["draft_id"] for document in batch
+            if document.get("draft_id") is not None)
+        existing = set(Draft.objects.filter(collection=collection,
+            draft_id__in=draft_ids).values_list("draft_id", flat=True))
+        new = []
+        for document in batch:
+            draft_id = document.get("draft_id")
+            if draft_id is not None:
+                if draft_id in existing or draft_id in self.taken_draft_ids:
+                    continue
+                self.taken_draft_ids.add(draft_id)
+            new.append(document)
+        return new
+
+    def build_drafts(self, batch, collection, pool):
+        # Render and transform the html, across processes
+        rendered = pool.map(render, [document["content"] for document in batch],
+            [document.get("content_html") for document in batch], chunksize=16)
+        for document, html in zip(batch, rendered):
+            document["content_html"] = html
+
+        slugs = self.allocate_slugs([
+            document.get("slug") or slugify(document["name"])[:255]
+            for document in batch])
+
+        drafts = []
+        for document, slug in zip(batch, slugs):
+            values = {key: document[key] for key in FIELDS if key in document}
+            values["slug"] = slug
+            if isinstance(values.get("date_published"), str):
+                values["date_published"] = parse_datetime(values["date_published"])
+            if values.get("published") and not values.get("date_published"):
+                values["date_published"] = datetime.datetime.now()
+            draft = Draft(collection=collection, **values)
+            draft.count_words()
+            drafts.append(draft)
+        return drafts
+
+    def allocate_slugs(self, proposed):
+        """
+        Make slugs unique against the database and everything
+        imported so far, with one query per batch rather than
+        one per draft. Clashes get the same uuid suffix that
+        Draft.save uses.
+        """
+        existing = set(Draft.objects.filter(
+            slug__in=set(proposed)).values_list("slug", flat=True))
+        slugs = []
+        for slug in proposed:
+            if slug in existing or slug in self.taken_slugs:
+                slug = "%s-%s" % (slug, uuid.uuid4())
+            self.taken_slugs.add(slug)
+            slugs.append(slug)
+        return slugs
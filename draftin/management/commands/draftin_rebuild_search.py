@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from draftin import search
+
+
+class Command(BaseCommand):
+    help = "Reinstall the full-text search index and its triggers, and reindex every draft."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        start = time.perf_counter()
+        with transaction.atomic(using=connection.alias):
+            search.install(connection)
+            backend = search.rebuild(connection)
+        if backend is None:
+            self.stdout.write("No full-text index on %s; searches use icontains." %
+                connection.vendor)
+        else:
+            self.stdout.write("Rebuilt the %s index in %.2fs." % (
+                backend, time.perf_counter() - start))
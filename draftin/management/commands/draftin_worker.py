@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from draftin import aio, images
+from draftin.jobs import arun_job, lease_job, run_job
+from draftin.settings import DRAFTIN_SETTINGS
+
+
+class Command(BaseCommand):
+    help = "Run queued Draftin jobs (images, gists, scrapes)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int,
+            default=DRAFTIN_SETTINGS["WORKER_CONCURRENCY"],
+            help="Number of jobs to run at once.")
+        parser.add_argument("--sleep", type=float, default=2.0,
+            help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--burst", action="store_true",
+            help="Exit once the queue is empty instead of polling.")
+        parser.add_argument("--async", action="store_true", dest="use_async",
+            help="Run jobs on one event loop instead of a thread each (needs httpx).")
+
+    def handle(self, *args, **options):
+        images.resize_in_pool = True
+        if options["use_async"]:
+            return asyncio.run(self.work_async(options))
+
+        stop = threading.Event()
+        workers = [
+            threading.Thread(target=self.work, args=(stop, options))
+            for _ in range(max(1, options["concurrency"]))
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+        for worker in workers:
+            worker.join()
+
+    def work(self, stop, options):
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                job = lease_job()
+                if job is None:
+                    if options["burst"]:
+                        return
+                    stop.wait(options["sleep"])
+                    continue
+                job = run_job(job)
+                self.stdout.write("%s: %s" % (job, job.attempts))
+        finally:
+            connection.close()
+
+    async def work_async(self, options):
+        slots = asyncio.Semaphore(max(1, options["concurrency"]))
+        running = set()
+        try:
+            while True:
+                await slots.acquire()
+                job = await aio.run_sync(lease_job)
+                if job is None:
+                    slots.release()
+                    if options["burst"]:
+                        break
+                    await asyncio.sleep(options["sleep"])
+                    continue
+                task = asyncio.ensure_future(self.run_async(job, slots))
+                running.add(task)
+                task.add_done_callback(running.discard)
+        finally:
+            if running:
+                await asyncio.wait(running)
+            await aio.close_client()
+
+    async def run_async(self, job, slots):
+        try:
+            job = await arun_job(job)
+            self.stdout.write("%s: %s" % (job, job.attempts))
+        finally:
+            slots.release()
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('draftin', '0016_imageasset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Gist',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gist_id', models.CharField(max_length=255, unique=True)),
+                ('etag', models.CharField(blank=True, default='', max_length=255)),
+                ('markdown', models.TextField(blank=True, default='')),
+                ('fetched_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('draftin', '0017_gist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='draft',
+            name='source_digest',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='draft',
+            name='source_etag',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='draft',
+            name='source_last_modified',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+    ]
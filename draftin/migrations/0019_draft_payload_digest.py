@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('draftin', '0018_draft_source_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='draft',
+            name='payload_digest',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
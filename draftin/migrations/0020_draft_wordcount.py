@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('draftin', '0019_draft_payload_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='draft',
+            name='reading_time',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Minutes'),
+        ),
+        migrations.AddField(
+            model_name='draft',
+            name='wordcount',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:55
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def detach_duplicate_drafts(apps, schema_editor):
+    """
+    Before (collection, draft_id) was unique, concurrent webhook
+    deliveries could create the same draft twice. Keep draft_id on
+    the most recently updated copy, and clear it on the others, so
+    the constraint can be added. Nothing is deleted, since other
+    models may point at either copy.
+    """
+    Draft = apps.get_model('draftin', 'Draft')
+    duplicates = (Draft.objects.exclude(draft_id=None)
+        .values('collection_id', 'draft_id')
+        .annotate(copies=Count('id')).filter(copies__gt=1))
+    for duplicate in duplicates:
+        copies = Draft.objects.filter(collection_id=duplicate['collection_id'],
+            draft_id=duplicate['draft_id']).order_by('-updated_at', '-id')
+        Draft.objects.filter(pk__in=[draft.pk for draft in copies[1:]]).update(draft_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('draftin', '0020_draft_wordcount'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='collection',
+            name='uuid',
+            field=models.CharField(db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(detach_duplicate_drafts, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='draft',
+            unique_together={('collection', 'draft_id')},
+        ),
+        migrations.AddIndex(
+            model_name='draft',
+            index=models.Index(fields=['published', '-date_published'], name='draftin_draft_published'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('draftin', '0021_draft_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageasset',
+            name='variants',
+            field=models.TextField(blank=True, default='', help_text='JSON list of responsive copies, made by make_variants().'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from draftin import search
+
+
+def install(apps, schema_editor):
+    search.install(schema_editor.connection)
+    search.rebuild(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('draftin', '0022_imageasset_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
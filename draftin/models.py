@@ -2,24 +2,22 @@ from __future__ import absolute_import, unicode_literals
 
 import re
 import os
-import lxml.html
+import json
+import math
 import uuid
 import datetime
-import requests
-import markdown
 import hashlib
+import functools
 try:
     import urlparse
 except ImportError:
     from urllib import parse as urlparse
 
-from PIL import Image
-
-from django.db import models
+from django.db import models, transaction
 from django.urls.exceptions import NoReverseMatch
-from django.utils.html import strip_tags
 from django.utils.text import slugify
 from django.utils.functional import cached_property
+from django.utils import timezone
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.urls import reverse
@@ -27,7 +25,10 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.utils.encoding import python_2_unicode_compatible
 
-from .helpers import gist_to_markdown, dropbox_url
+from .helpers import count_words, html_to_text
+from .feeds import invalidate_feeds
+from .fragments import invalidate_draft
+from . import search
 from .settings import DRAFTIN_SETTINGS
 
 
@@ -37,16 +38,10 @@ re.UNICODE)
 
 def resize_image(path, size):
     """
-    Limits image (path) to the dimensions passed as [w,h]
+    Moved to draftin.images, which imports PIL.
     """
-    try:
-        im = Image.open(path)
-    except Exception:
-        return
-
-    if im.size[0] > size[0] or im.size[1] > size[1]:
-        im.thumbnail(size, resample=Image.ANTIALIAS)
-        im.save(path)
+    from .images import resize_image
+    return resize_image(path, size)
 
 
 @python_2_unicode_compatible
@@ -60,7 +55,7 @@ class Collection(models.Model):
     object_id = models.PositiveIntegerField(blank=True, null=True)
     parent = GenericForeignKey('content_type', 'object_id')
     name = models.CharField(max_length=255, default="")
-    uuid = models.CharField(max_length=255, editable=False)
+    uuid = models.CharField(max_length=255, editable=False, db_index=True)
     auto_publish = models.BooleanField(default=True)
 
     def __str__(self):
@@ -98,6 +93,64 @@ class Publication(models.Model):
         return self.name
 
 
+@python_2_unicode_compatible
+class ImageAsset(models.Model):
+    """
+    A downloaded image, stored under the hash of its bytes,
+    and the source url it was fetched from.
+    """
+    url_hash = models.CharField(max_length=40, unique=True, editable=False)
+    source_url = models.TextField()
+    digest = models.CharField(max_length=64, db_index=True)
+    path = models.CharField(max_length=255)
+    variants = models.TextField(blank=True, default="",
+        help_text="JSON list of responsive copies, made by make_variants().")
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+
+    def __str__(self):
+        return self.source_url
+
+    def get_variants(self):
+        return json.loads(self.variants or "[]")
+
+    @staticmethod
+    def hash_url(url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    @property
+    def file_url(self):
+        return os.path.join(settings.MEDIA_URL, self.path)
+
+    def exists(self):
+        file_path = os.path.join(settings.MEDIA_ROOT, self.path)
+        return os.path.exists(file_path) and os.path.getsize(file_path) > 0
+
+
+class DraftQuerySet(models.QuerySet):
+
+    def published(self):
+        """
+        Published drafts, newest first.
+        """
+        return self.filter(published=True).order_by("-date_published")
+
+    def for_listing(self):
+        """
+        Everything an index page needs, without the full text.
+        """
+        return self.defer("content", "content_html").select_related("collection")
+
+    def search(self, query):
+        """
+        Drafts matching every word of the query, best match first,
+        with a search_rank. See draftin.search.
+        """
+        return search.search(self, query)
+
+    def by_collection(self, collection):
+        return self.filter(collection=collection)
+
+
 @python_2_unicode_compatible
 class Draft(models.Model):
     collection = models.ForeignKey(Collection, on_delete=models.CASCADE)
@@ -117,16 +170,53 @@ class Draft(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
     last_synced_at = models.DateTimeField(auto_now=True)
+    source_etag = models.CharField(max_length=255, blank=True, default="", editable=False)
+    source_last_modified = models.CharField(max_length=255, blank=True, default="", editable=False)
+    source_digest = models.CharField(max_length=64, blank=True, default="", editable=False)
+    payload_digest = models.CharField(max_length=64, blank=True, default="", editable=False)
     published = models.BooleanField(default=False)
     date_published = models.DateTimeField(blank=True, null=True)
+    wordcount = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveIntegerField(default=0, editable=False,
+        help_text="Minutes")
+
+    objects = DraftQuerySet.as_manager()
+
+    _scraped_url = None
+    _counted = None
+    _loaded_updated_at = None
+
+    class Meta:
+        unique_together = [("collection", "draft_id")]
+        indexes = [
+            models.Index(fields=["published", "-date_published"],
+                name="draftin_draft_published"),
+        ]
 
     def __str__(self):
         return self.name or self.draft_id
 
-    @cached_property
-    def wordcount(self):
-        text = strip_tags(self.content_html) or self.content
-        return len(list(filter(None, text.split(" "))))
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Draft, cls).from_db(db, field_names, values)
+        # Remember which url the stored content was scraped from
+        instance._scraped_url = instance.__dict__.get("external_url")
+        # ...and what the stored wordcount was counted from
+        instance._counted = (instance.__dict__.get("content_html"),
+            instance.__dict__.get("content"))
+        # ...and which version of it fragments were cached under
+        instance._loaded_updated_at = instance.__dict__.get("updated_at")
+        return instance
+
+    def count_words(self):
+        """
+        Store the wordcount and reading time of the current content.
+        """
+        text = html_to_text(self.content_html).strip() or self.content
+        self.wordcount = count_words(text)
+        self.reading_time = int(math.ceil(
+            self.wordcount / float(DRAFTIN_SETTINGS["WORDS_PER_MINUTE"])))
+        self._counted = (self.content_html, self.content)
 
     @cached_property
     def domain(self):
@@ -155,87 +245,139 @@ class Draft(models.Model):
         if self.published and not self.date_published:
             self.date_published = datetime.datetime.now()
 
-        return super(Draft, self).save(*args, **kwargs)
+        # Recount words if the content changed
+        loaded = not {"content", "content_html"} & self.get_deferred_fields()
+        if loaded and self._counted != (self.content_html, self.content):
+            self.count_words()
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = set(kwargs["update_fields"]) | {
+                    "wordcount", "reading_time"}
+
+        # updated_at versions cached fragments, so move it on
+        # whenever the content changes
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"content", "content_html"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"updated_at"}
+        invalidate_draft(self)
+
+        result = super(Draft, self).save(*args, **kwargs)
+        self._loaded_updated_at = self.updated_at
+        # After commit, so a feed rebuilt meanwhile can't cache the old draft
+        transaction.on_commit(functools.partial(invalidate_feeds, self))
+        return result
+
+    def delete(self, *args, **kwargs):
+        transaction.on_commit(functools.partial(invalidate_feeds, self))
+        return super(Draft, self).delete(*args, **kwargs)
+
+    # Syncing lives in draftin.pipeline, imported on first use,
+    # so reading drafts doesn't load requests, lxml, markdown or PIL.
 
     def download_content(self):
+        """
+        Scrape the markdown at external_url and rebuild the html.
 
-        # Scrape markdown files from Dropbox
-        url = dropbox_url(self.external_url)
-        if url.startswith("https://www.dropbox.com"):
-            url = url.replace("https://www.dropbox.com", "https://dl.dropbox.com", 1)
-        try:
-            resp = requests.get(url)
-            resp.raise_for_status()
-        except Exception as e:
-            raise ValidationError("External url failed to scrape.")
-        self.content = resp.text
+        Returns False without doing any work if the upstream file
+        is unchanged since the last scrape (a 304, or the same bytes).
+        """
+        from . import pipeline
+        return pipeline.download_content(self)
 
-        # If any code is embedded as a gist, download those
-        self.download_gists()
+    def content_request(self):
+        from . import pipeline
+        return pipeline.content_request(self)
 
-        # Make html
-        self.content_html = markdown.markdown(self.content,
-            extensions=[
-                'markdown.extensions.fenced_code',
-                'markdown.extensions.footnotes',
-            ])
+    def apply_content(self, resp, revalidate):
+        from . import pipeline
+        return pipeline.apply_content(self, resp, revalidate)
 
-        # Scrape images
-        self.download_images()
+    def render_html(self):
+        from . import pipeline
+        return pipeline.render_html(self)
 
     def download_images(self):
-        tree = lxml.html.fragment_fromstring(self.content_html, create_parent="div")
-        images = tree.xpath("//img[@src]")
-        for img in images:
-            src = dropbox_url(img.attrib["src"])
-            if src.startswith(settings.MEDIA_URL):
-                continue  # Don't repeat
+        from . import pipeline
+        return pipeline.download_images(self)
 
-            try:
-                resp = requests.get(src)
-            except requests.exceptions.MissingSchema:
-                continue
+    def images_to_fetch(self):
+        from . import pipeline
+        return pipeline.images_to_fetch(self)
 
-            filename = resp.headers.get("x-file-name")
-            if not filename:  # Build from the src if its not in the header
-                filename = "%s.jpg" % hashlib.md5(urlparse.urlparse(src).path.encode("utf-8")).hexdigest()
+    def apply_images(self, tree, sources, assets, missing, stored):
+        from . import pipeline
+        return pipeline.apply_images(self, tree, sources, assets, missing, stored)
 
-            directory = os.path.join("draftin/img", str(self.id))
-            
-            file_path = os.path.join(settings.MEDIA_ROOT, directory, filename)
-            file_url = os.path.join(settings.MEDIA_URL, directory, filename)
+    def download_gists(self):
+        """
+        If the post contains embedded gists, convert
+        them to markdown fenced code and contain them
+        in the contents.
+        """
+        from . import pipeline
+        return pipeline.download_gists(self)
 
-            # Update the content
-            self.content = self.content.replace(src, file_url)
-            img.attrib["src"] = file_url
+    def gists_to_fetch(self):
+        from . import pipeline
+        return pipeline.gists_to_fetch(self)
 
-            # If this item exists, skip it
-            if os.path.exists(file_path) and os.path.getsize(file_path):
-                continue
+    def apply_gists(self, gist_ids, cached, results):
+        from . import pipeline
+        return pipeline.apply_gists(self, gist_ids, cached, results)
 
-            # Download the file
-            directory = os.path.join(settings.MEDIA_ROOT, directory)
-            if not os.path.exists(directory):
-                os.makedirs(directory)
+@python_2_unicode_compatible
+class Gist(models.Model):
+    """
+    A gist embedded in a draft, cached as markdown
+    along with the ETag to revalidate it.
+    """
+    gist_id = models.CharField(max_length=255, unique=True)
+    etag = models.CharField(max_length=255, blank=True, default="")
+    markdown = models.TextField(blank=True, default="")
+    fetched_at = models.DateTimeField(auto_now=True)
 
-            with open(file_path, "wb") as f:
-                f.write(resp.content)
-                f.close()
+    def __str__(self):
+        return self.gist_id
 
-            # Resize image
-            resize_image(file_path, DRAFTIN_SETTINGS["MAX_IMAGE_SIZE"])
 
-        self.content_html = lxml.html.tostring(tree, encoding="unicode")
+@python_2_unicode_compatible
+class Job(models.Model):
+    """
+    Background work for a Draft, queued by the webhook
+    and run by `manage.py draftin_worker`.
+    """
+    IMAGES = "images"
+    GISTS = "gists"
+    SCRAPE = "scrape"
+    KIND_CHOICES = (
+        (IMAGES, "Download images"),
+        (GISTS, "Download gists"),
+        (SCRAPE, "Scrape external url"),
+    )
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    draft = models.ForeignKey(Draft, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES,
+        default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    leased_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
-    def download_gists(self):
-        """
-        If the post contains embedded gists, convert
-        them to markdown fenced code and contain them
-        in the contents.
-        """
-        matches = re.finditer(GIST_RE, self.content)
-        for match in matches:
-            md_gist = gist_to_markdown(match.groups()[0])
-            if md_gist:
-                self.content = self.content.replace(match.group(), md_gist)
+    class Meta:
+        index_together = [("status", "run_after")]
 
+    def __str__(self):
+        return "%s for %s (%s)" % (self.get_kind_display(), self.draft, self.status)
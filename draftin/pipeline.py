@@ -0,0 +1,235 @@
+"""
+The sync pipeline: scraping, gists, rendering and images.
+
+This is where requests, lxml, markdown and PIL get imported. The Draft
+methods that sync (download_content(), render_html() and so on) load
+it the first time they're called, so processes that only read drafts,
+like web workers and the admin, never pay for it.
+
+Each stage calls the next through the draft's methods,
+so subclasses can still override any one of them.
+"""
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .helpers import dropbox_url, fetch_gist, get_session, replace_urls
+from .images import make_variants, store_image
+from .models import GIST_RE, Gist, ImageAsset
+from .rendering import render_markdown
+from .settings import DRAFTIN_SETTINGS
+from .stats import timed
+from .transforms import parse_html, serialize_html, transform_tree
+
+
+def download_content(draft):
+    """
+    Scrape the markdown at external_url and rebuild the html.
+
+    Returns False without doing any work if the upstream file
+    is unchanged since the last scrape (a 304, or the same bytes).
+    """
+    url, headers, revalidate = draft.content_request()
+    with timed("fetch") as stage:
+        try:
+            resp = get_session(url).get(url, headers=headers,
+                timeout=DRAFTIN_SETTINGS["HTTP_TIMEOUT"])
+            resp.raise_for_status()
+        except Exception as e:
+            raise ValidationError("External url failed to scrape.")
+        stage.bytes = len(resp.content)
+    if not draft.apply_content(resp, revalidate):
+        return False
+
+    # If any code is embedded as a gist, download those
+    draft.download_gists()
+
+    # Make html
+    draft.render_html()
+
+    # Scrape images
+    draft.download_images()
+    return True
+
+
+def content_request(draft):
+    """
+    The (url, headers, revalidate) to scrape external_url with.
+    """
+
+    # Scrape markdown files from Dropbox
+    url = dropbox_url(draft.external_url)
+    if url.startswith("https://www.dropbox.com"):
+        url = url.replace("https://www.dropbox.com", "https://dl.dropbox.com", 1)
+
+    # Only revalidate what we scraped from this same url
+    revalidate = bool(draft.content_html) and draft._scraped_url == draft.external_url
+    headers = {}
+    if revalidate and draft.source_etag:
+        headers["If-None-Match"] = draft.source_etag
+    if revalidate and draft.source_last_modified:
+        headers["If-Modified-Since"] = draft.source_last_modified
+    return url, headers, revalidate
+
+
+def apply_content(draft, resp, revalidate):
+    """
+    Take the markdown from a scrape response. Returns False
+    if it's unchanged, so there's nothing more to do.
+    """
+    if resp.status_code == 304:
+        return False
+
+    digest = hashlib.sha256(resp.content).hexdigest()
+    draft.source_etag = resp.headers.get("ETag", "")
+    draft.source_last_modified = resp.headers.get("Last-Modified", "")
+    if revalidate and digest == draft.source_digest:
+        return False
+
+    draft.source_digest = digest
+    draft._scraped_url = draft.external_url
+    draft.content = resp.text
+    return True
+
+
+def render_html(draft):
+    with timed("render", bytes=len(draft.content)):
+        draft.content_html = render_markdown(draft.content, scope=draft.pk)
+
+
+def download_images(draft):
+    with timed("images") as stage:
+        tree, sources, assets, missing = draft.images_to_fetch()
+        stage.items = len(missing)
+
+        # Fetch concurrently. map() yields results in the order
+        # the sources were found, so the rewrite is deterministic.
+        workers = max(1, min(len(missing),
+            DRAFTIN_SETTINGS["IMAGE_FETCH_CONCURRENCY"]))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            stored = list(pool.map(store_image, missing))
+
+        draft.apply_images(tree, sources, assets, missing, stored)
+
+
+def images_to_fetch(draft):
+    """
+    Parse content_html for images. Returns the tree, the image
+    sources in document order, the ImageAssets already stored
+    for them, and the sources that still need downloading.
+    """
+    tree = parse_html(draft.content_html)
+
+    sources = []
+    for img in tree.xpath("//img[@src]"):
+        src = dropbox_url(img.attrib["src"])
+        if src.startswith(settings.MEDIA_URL):
+            continue  # Don't repeat
+        if src not in sources:
+            sources.append(src)
+
+    # Urls we've stored before don't need to be fetched again
+    assets = {asset.source_url: asset for asset in ImageAsset.objects.filter(
+        url_hash__in=[ImageAsset.hash_url(src) for src in sources])}
+    missing = [src for src in sources
+        if src not in assets or not assets[src].exists()]
+    return tree, sources, assets, missing
+
+
+def variants_json(variants):
+    """
+    make_variants()'s result as stored: empty, to try again, if it failed.
+    """
+    return json.dumps(variants) if variants is not None else ""
+
+
+def apply_images(draft, tree, sources, assets, missing, stored):
+    """
+    Record what store_image() returned for each missing source,
+    run the html transformers (which point images at the stored
+    copies), and point the markdown at the stored copies too.
+    """
+    for src, result in zip(missing, stored):
+        if result:
+            digest, path, variants = result
+            assets[src], _ = ImageAsset.objects.update_or_create(
+                url_hash=ImageAsset.hash_url(src),
+                defaults={"source_url": src, "digest": digest, "path": path,
+                    "variants": variants_json(variants)})
+
+    # Assets stored before variants existed, or whose copies
+    # couldn't be made last time, get them now
+    for asset in assets.values():
+        if not asset.variants:
+            asset.variants = variants_json(make_variants(asset.path))
+            asset.save(update_fields=["variants"])
+
+    # One parse and one serialize for every transform of the html,
+    # and one pass over the markdown for every image url.
+    transform_tree(tree, assets, draft)
+    draft.content_html = serialize_html(tree)
+    draft.content = replace_urls(draft.content,
+        {src: assets[src].file_url for src in sources if src in assets})
+
+
+def download_gists(draft):
+    """
+    If the post contains embedded gists, convert
+    them to markdown fenced code and contain them
+    in the contents.
+
+    Gists are cached with their ETag, fetched in parallel,
+    and substituted in a single pass over the content.
+    """
+    gist_ids, cached = draft.gists_to_fetch()
+    if not gist_ids:
+        return
+
+    def fetch(gist_id):
+        gist = cached.get(gist_id)
+        return fetch_gist(gist_id, gist.etag if gist else "")
+
+    with timed("gists", items=len(gist_ids)):
+        workers = min(len(gist_ids), DRAFTIN_SETTINGS["GIST_FETCH_CONCURRENCY"])
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            results = list(pool.map(fetch, gist_ids))
+
+        draft.apply_gists(gist_ids, cached, results)
+
+
+def gists_to_fetch(draft):
+    """
+    The ids of the gists embedded in the content, in order,
+    and the cached Gists we already have for them.
+    """
+    gist_ids = []
+    for match in GIST_RE.finditer(draft.content):
+        if match.group(1) not in gist_ids:
+            gist_ids.append(match.group(1))
+    if not gist_ids:
+        return [], {}
+    cached = {gist.gist_id: gist for gist in Gist.objects.filter(gist_id__in=gist_ids)}
+    return gist_ids, cached
+
+
+def apply_gists(draft, gist_ids, cached, results):
+    """
+    Store what fetch_gist() returned for each gist, and
+    substitute them into the content.
+    """
+    md_gists = {}
+    for gist_id, result in zip(gist_ids, results):
+        if result and result[1] is not None:
+            etag, md_gist = result
+            cached[gist_id], _ = Gist.objects.update_or_create(gist_id=gist_id,
+                defaults={"etag": etag, "markdown": md_gist})
+        if gist_id in cached:
+            # Unchanged, or GitHub is down: use what we have
+            md_gists[gist_id] = cached[gist_id].markdown
+
+    draft.content = GIST_RE.sub(
+        lambda match: md_gists.get(match.group(1)) or match.group(),
+        draft.content)
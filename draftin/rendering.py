@@ -0,0 +1,418 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import markdown
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+
+from .settings import DRAFTIN_SETTINGS
+
+MARKDOWN_EXTENSIONS = [
+    'markdown.extensions.fenced_code',
+    'markdown.extensions.footnotes',
+]
+
+FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+LIST_ITEM_RE = re.compile(r"^ {0,3}(?:[*+-]|\d+\.)\s")
+
+# Footnote and link definitions, and raw html, which
+# can change how markdown in other blocks is read.
+CROSS_BLOCK_RE = re.compile(r"^ {0,3}(?:\[[^\]]+\]:|<)")
+
+# Bump when a change here alters the html produced
+# for the same markdown, to retire cached renders.
+RENDERER_VERSION = 1
+
+
+class LRUCache(object):
+    """
+    A small thread-safe in-process cache, kept in front of
+    Django's cache so repeat renders skip the network too.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+_lru = LRUCache(DRAFTIN_SETTINGS["RENDER_CACHE_SIZE"])
+_renderer = None
+
+
+def footnote_ref_html(key, index, repeat=0):
+    key = escape(key)
+    ref_id = "fnref%s:%s" % (repeat + 1 if repeat else "", key)
+    return '<sup id="%s"><a class="footnote-ref" href="#fn:%s">%s</a></sup>' % (
+        ref_id, key, index)
+
+
+def footnote_backref_html(key, index, repeat=0):
+    key = escape(key)
+    ref_id = "fnref%s:%s" % (repeat + 1 if repeat else "", key)
+    return ('&#160;<a class="footnote-backref" href="#%s" title="Jump back to '
+        'footnote %s in the text">&#8617;</a>' % (ref_id, index))
+
+
+FOOTNOTES_OPEN = '<div class="footnote">\n<hr />\n<ol>\n'
+FOOTNOTES_CLOSE = '</ol>\n</div>\n'
+
+
+class Renderer(object):
+    """
+    Turns markdown into html. Subclasses build a converter in
+    build(), which is kept per thread, since most aren't thread-safe.
+    """
+    # Goes into render cache keys, so cached html from
+    # one renderer (or version) is never served for another.
+    name = None
+
+    def __init__(self):
+        self.local = threading.local()
+
+    @property
+    def version(self):
+        return "%s:%s" % (self.name, RENDERER_VERSION)
+
+    def build(self):
+        raise NotImplementedError
+
+    def get_converter(self):
+        converter = getattr(self.local, "converter", None)
+        if converter is None:
+            converter = self.local.converter = self.build()
+        return converter
+
+    def convert(self, text):
+        raise NotImplementedError
+
+
+class MarkdownRenderer(Renderer):
+    """
+    Python-Markdown with fenced code and footnotes. The default.
+    """
+    name = "markdown"
+
+    @property
+    def version(self):
+        return "%s:%s:%s:%s" % (self.name, markdown.__version__,
+            ",".join(MARKDOWN_EXTENSIONS), RENDERER_VERSION)
+
+    def build(self):
+        return markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+
+    def convert(self, text):
+        return self.get_converter().reset().convert(text)
+
+
+def _parse_mistune_footnote(inline, m, state):
+    """
+    mistune's footnote parser, noting the label as written (mistune
+    folds its case) and how many times it's been referenced.
+    """
+    from mistune.plugins import footnotes
+    end = footnotes.parse_inline_footnote(inline, m, state)
+    token = state.tokens[-1]
+    if token["type"] == "footnote_ref":
+        key = token["raw"]
+        labels = state.env.setdefault("footnote_labels", {})
+        repeats = state.env.setdefault("footnote_repeats", {})
+        token["attrs"]["label"] = labels.setdefault(key, m.group("footnote_key"))
+        token["attrs"]["repeat"] = repeats.get(key, 0)
+        repeats[key] = repeats.get(key, 0) + 1
+    return end
+
+
+_mistune_html_renderer = None
+
+
+def mistune_html_renderer():
+    """
+    The mistune.HTMLRenderer subclass MistuneRenderer uses, defined
+    on first use, since mistune is only imported when it's used.
+    """
+    global _mistune_html_renderer
+    if _mistune_html_renderer is not None:
+        return _mistune_html_renderer
+    import mistune
+
+    class MistuneHTMLRenderer(mistune.HTMLRenderer):
+        """
+        Draws code blocks and footnotes the way Python-Markdown does.
+        """
+
+        def block_code(self, code, info=None):
+            if not code.endswith("\n"):
+                code += "\n"
+            return super(MistuneHTMLRenderer, self).block_code(code, info)
+
+        def render_token(self, token, state):
+            if token["type"] == "footnote_item":
+                key = token["attrs"]["key"]
+                token["attrs"]["label"] = state.env["footnote_labels"].get(key, key)
+                token["attrs"]["repeats"] = state.env["footnote_repeats"].get(key, 1)
+            return super(MistuneHTMLRenderer, self).render_token(token, state)
+
+        def footnote_ref(self, key, index, label, repeat):
+            return footnote_ref_html(label, index, repeat)
+
+        def footnotes(self, text):
+            return FOOTNOTES_OPEN + text + FOOTNOTES_CLOSE
+
+        def footnote_item(self, text, key, index, label, repeats):
+            text = text.rstrip()
+            backref = "".join(footnote_backref_html(label, index, repeat)
+                for repeat in range(repeats))
+            if text.endswith("</p>"):
+                text = text[:-len("</p>")] + backref + "</p>"
+            else:
+                text = text + "\n<p>" + backref + "</p>"
+            return '<li id="fn:%s">\n%s\n</li>\n' % (escape(label), text)
+
+    _mistune_html_renderer = MistuneHTMLRenderer
+    return _mistune_html_renderer
+
+
+class MistuneRenderer(Renderer):
+    """
+    mistune 3, with footnotes drawn the way Python-Markdown draws them.
+    """
+    name = "mistune"
+
+    def __init__(self):
+        try:
+            import mistune
+        except ImportError:
+            mistune = None
+        if mistune is None or not mistune.__version__.startswith("3."):
+            raise ImproperlyConfigured("MistuneRenderer requires mistune 3.")
+        self.mistune = mistune
+        super(MistuneRenderer, self).__init__()
+
+    @property
+    def version(self):
+        return "%s:%s:%s" % (self.name, self.mistune.__version__, RENDERER_VERSION)
+
+    def build(self):
+        from mistune.plugins import footnotes
+        md = self.mistune.Markdown(renderer=mistune_html_renderer()(escape=False),
+            plugins=[footnotes.footnotes])
+        md.inline.register("footnote", footnotes.INLINE_FOOTNOTE,
+            _parse_mistune_footnote, before="link")
+        return md
+
+    def convert(self, text):
+        return self.get_converter()(text)
+
+
+def _footnote_label(token):
+    return token.meta.get("label") or str(token.meta["id"] + 1)
+
+
+def _mdit_footnote_ref(renderer, tokens, idx, options, env):
+    token = tokens[idx]
+    return footnote_ref_html(_footnote_label(token), token.meta["id"] + 1,
+        token.meta.get("subId", 0))
+
+
+def _mdit_footnote_open(renderer, tokens, idx, options, env):
+    return '<li id="fn:%s">\n' % escape(_footnote_label(tokens[idx]))
+
+
+def _mdit_footnote_anchor(renderer, tokens, idx, options, env):
+    token = tokens[idx]
+    return footnote_backref_html(_footnote_label(token), token.meta["id"] + 1,
+        token.meta.get("subId", 0))
+
+
+class MarkdownItRenderer(Renderer):
+    """
+    markdown-it-py (CommonMark) with mdit-py-plugins' footnotes,
+    drawn the way Python-Markdown draws them.
+    """
+    name = "markdown-it"
+
+    def __init__(self):
+        try:
+            import markdown_it
+            import mdit_py_plugins.footnote
+        except ImportError:
+            raise ImproperlyConfigured(
+                "MarkdownItRenderer requires markdown-it-py and mdit-py-plugins.")
+        self.markdown_it = markdown_it
+        super(MarkdownItRenderer, self).__init__()
+
+    @property
+    def version(self):
+        return "%s:%s:%s" % (self.name, self.markdown_it.__version__, RENDERER_VERSION)
+
+    def build(self):
+        from mdit_py_plugins.footnote import footnote_plugin
+        md = self.markdown_it.MarkdownIt("commonmark").use(footnote_plugin)
+        md.add_render_rule("footnote_ref", _mdit_footnote_ref)
+        md.add_render_rule("footnote_block_open", lambda *args: FOOTNOTES_OPEN)
+        md.add_render_rule("footnote_block_close", lambda *args: FOOTNOTES_CLOSE)
+        md.add_render_rule("footnote_open", _mdit_footnote_open)
+        md.add_render_rule("footnote_close", lambda *args: "</li>\n")
+        md.add_render_rule("footnote_anchor", _mdit_footnote_anchor)
+        return md
+
+    def convert(self, text):
+        return self.get_converter().render(text)
+
+
+def get_renderer():
+    """
+    The renderer named by DRAFTIN_SETTINGS["RENDERER"].
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = import_string(DRAFTIN_SETTINGS["RENDERER"])()
+    return _renderer
+
+
+def convert_markdown(text):
+    """
+    Render markdown to html, without any caching.
+    """
+    return get_renderer().convert(text)
+
+
+def render_cache_key(text):
+    digest = hashlib.sha1()
+    digest.update(text.encode("utf-8"))
+    digest.update(get_renderer().version.encode("utf-8"))
+    return "draftin:render:%s" % digest.hexdigest()
+
+
+def continues_block(block, line):
+    """
+    Whether a chunk starting with `line`, after a blank line, is part
+    of `block`: indented continuations, more items of a list, more
+    lines of a blockquote.
+    """
+    first = block[0]
+    return (line[:1] in (" ", "\t") or
+        bool(LIST_ITEM_RE.match(line) and LIST_ITEM_RE.match(first)) or
+        (line.startswith(">") and first.startswith(">")))
+
+
+def split_blocks(text):
+    """
+    Split markdown into top-level blocks that render the same on
+    their own as they do in the document. Returns None for documents
+    with footnotes, link definitions or raw html, which can reach
+    across blocks.
+    """
+    blocks = []
+    current = []
+    blank_lines = 0
+    fence = None
+    for line in text.splitlines():
+        if fence:
+            current.append(line)
+            stripped = line.strip()
+            if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                fence = None
+            continue
+        if CROSS_BLOCK_RE.match(line):
+            return None
+        if not line.strip():
+            if current:
+                blocks.append(current)
+                current = []
+            blank_lines += 1
+            continue
+        if not current and blocks and continues_block(blocks[-1], line):
+            current = blocks.pop()
+            current.extend([""] * blank_lines)
+        blank_lines = 0
+        match = FENCE_RE.match(line)
+        if match:
+            fence = match.group(1)
+        current.append(line)
+    if current:
+        blocks.append(current)
+    return ["\n".join(block) for block in blocks]
+
+
+def blocks_cache_key(scope):
+    digest = hashlib.sha1()
+    digest.update(("%s:%s" % (scope, get_renderer().version)).encode("utf-8"))
+    return "draftin:blocks:%s" % digest.hexdigest()
+
+
+def render_blocks(text, scope):
+    """
+    Render markdown a block at a time. The html of each block is
+    kept (by hash) under `scope`, e.g. a draft's pk, so re-rendering
+    the next version only converts the blocks that changed. Falls
+    back to rendering the whole document when blocks can't stand alone.
+    """
+    alias = DRAFTIN_SETTINGS["RENDER_CACHE"]
+    blocks = split_blocks(text) if alias else None
+    if not blocks or len(blocks) == 1:
+        return convert_markdown(text)
+
+    cache = caches[alias]
+    key = blocks_cache_key(scope)
+    previous = cache.get(key) or {}
+    rendered = {}
+    digests = []
+    for block in blocks:
+        digest = hashlib.sha1(block.encode("utf-8")).hexdigest()
+        digests.append(digest)
+        if digest not in rendered:
+            html = previous.get(digest)
+            rendered[digest] = html if html is not None else convert_markdown(block).strip()
+    cache.set(key, rendered, DRAFTIN_SETTINGS["RENDER_CACHE_TIMEOUT"])
+    return "\n".join(rendered[digest] for digest in digests)
+
+
+def render_markdown(text, scope=None):
+    """
+    Render markdown to html, reusing earlier renders
+    of the same source where possible. Pass a `scope`
+    (e.g. a draft's pk) to reuse the unchanged blocks
+    of the document's last render too.
+    """
+    key = render_cache_key(text)
+    html = _lru.get(key)
+    if html is not None:
+        return html
+
+    alias = DRAFTIN_SETTINGS["RENDER_CACHE"]
+    if alias:
+        html = caches[alias].get(key)
+    if html is None:
+        if scope is not None and DRAFTIN_SETTINGS["RENDER_BLOCKS"]:
+            html = render_blocks(text, scope)
+        else:
+            html = convert_markdown(text)
+        if alias:
+            caches[alias].set(key, html, DRAFTIN_SETTINGS["RENDER_CACHE_TIMEOUT"])
+
+    _lru.set(key, html)
+    return html
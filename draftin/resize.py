@@ -0,0 +1,96 @@
+"""
+The image work done in the process pool (see images.get_pool()).
+
+The pool's processes are spawned, so they don't see settings changed
+at runtime, and may not be able to load settings at all. Nothing here
+touches Django: callers pass absolute paths and the setting values.
+"""
+import os
+import tempfile
+
+from PIL import Image, UnidentifiedImageError
+
+VARIANT_SOURCE_FORMATS = ("JPEG", "PNG", "WEBP")
+
+
+def resize_image(path, size):
+    """
+    Limits image (path) to the dimensions passed as [w,h]
+    """
+    try:
+        # Only reads the header; pixels are decoded on demand
+        im = Image.open(path)
+    except Exception:
+        return
+
+    if im.size[0] <= size[0] and im.size[1] <= size[1]:
+        return
+
+    # JPEGs can be decoded straight to 1/2, 1/4 or 1/8 scale,
+    # which is much faster and smaller than a full decode.
+    format = im.format
+    if format == "JPEG":
+        im.draft(im.mode, (size[0], size[1]))
+    im.thumbnail(size, resample=Image.LANCZOS)
+    im.save(path, format)
+
+
+def save_image(im, file_path, format, permissions=None, **options):
+    """
+    Save to a temp file and move it into place, so a
+    half-written file is never served.
+    """
+    directory, filename = os.path.split(file_path)
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=filename,
+            delete=False) as f:
+        temp_path = f.name
+    try:
+        im.save(temp_path, format, **options)
+        os.chmod(temp_path, permissions or 0o644)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def build_variants(media_root, path, widths, formats, permissions):
+    """
+    make_variants(), with the settings it needs passed in.
+    """
+    try:
+        im = Image.open(os.path.join(media_root, path))
+    except UnidentifiedImageError:
+        return []  # Not a format PIL reads, like SVG
+    except (IOError, OSError):
+        return None
+    if im.format not in VARIANT_SOURCE_FORMATS:
+        return []
+
+    Image.init()  # Register every plugin, so Image.SAVE is complete
+    width, height = im.size
+    base, extension = os.path.splitext(path)
+    widths = sorted(w for w in set(widths) if w < width)
+
+    targets = [(w, extension, im.format) for w in widths]
+    for format in formats:
+        format = format.upper()
+        if format != im.format and format in Image.SAVE:
+            targets += [(w, "." + format.lower(), format) for w in widths + [width]]
+
+    variants = [{"path": path, "width": width, "type": Image.MIME[im.format]}]
+    for w, variant_extension, format in targets:
+        variant_path = "%s-%s%s" % (base, w, variant_extension)
+        file_path = os.path.join(media_root, variant_path)
+        if not os.path.exists(file_path):
+            copy = im
+            if format == "JPEG" and copy.mode not in ("RGB", "L"):
+                copy = copy.convert("RGB")
+            elif copy.mode not in ("RGB", "RGBA", "L"):
+                copy = copy.convert("RGBA")
+            if w < width:
+                copy = copy.resize((w, max(1, int(round(height * w / float(width))))),
+                    resample=Image.LANCZOS)
+            save_image(copy, file_path, format, permissions)
+        variants.append({"path": variant_path, "width": w,
+            "type": Image.MIME.get(format, "image/" + format.lower())})
+    return variants
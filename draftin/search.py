@@ -0,0 +1,192 @@
+"""
+Full-text search over drafts' titles, deks and content.
+
+On PostgreSQL, draftin_draft gets a weighted tsvector column with a
+GIN index. On SQLite, an FTS5 table indexes the same columns. Either
+way, database triggers keep the index in step with every write,
+including bulk_create() and QuerySet.update(). Other databases (or
+SQLite builds without FTS5) fall back to icontains.
+
+The SQL is installed by a migration; `manage.py draftin_rebuild_search`
+reinstalls it (SQLite drops triggers when Django rebuilds a table) and
+reindexes every draft.
+"""
+import re
+
+from django.db import connection as default_connection, connections
+from django.db.models import Q, Value, FloatField
+from django.db.models.expressions import RawSQL
+
+# The text search configuration used on PostgreSQL.
+SEARCH_CONFIG = "pg_catalog.english"
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+POSTGRES_VECTOR = """
+    setweight(to_tsvector('%(config)s', coalesce(%(row)sname, '')), 'A') ||
+    setweight(to_tsvector('%(config)s', coalesce(%(row)sdescription, '')), 'B') ||
+    setweight(to_tsvector('%(config)s', coalesce(%(row)scontent, '')), 'C')
+"""
+
+POSTGRES_INSTALL = [
+    "ALTER TABLE draftin_draft ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    "CREATE INDEX IF NOT EXISTS draftin_draft_search ON draftin_draft USING GIN (search_vector)",
+    """
+    CREATE OR REPLACE FUNCTION draftin_draft_search_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := %s;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """ % (POSTGRES_VECTOR % {"config": SEARCH_CONFIG, "row": "NEW."}),
+    "DROP TRIGGER IF EXISTS draftin_draft_search_update ON draftin_draft",
+    """
+    CREATE TRIGGER draftin_draft_search_update
+    BEFORE INSERT OR UPDATE OF name, description, content ON draftin_draft
+    FOR EACH ROW EXECUTE PROCEDURE draftin_draft_search_update()
+    """,
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS draftin_draft_search_update ON draftin_draft",
+    "DROP FUNCTION IF EXISTS draftin_draft_search_update()",
+    "DROP INDEX IF EXISTS draftin_draft_search",
+    "ALTER TABLE draftin_draft DROP COLUMN IF EXISTS search_vector",
+]
+
+POSTGRES_REBUILD = ["UPDATE draftin_draft SET search_vector = %s" % (
+    POSTGRES_VECTOR % {"config": SEARCH_CONFIG, "row": ""})]
+
+SQLITE_INSTALL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS draftin_draft_fts USING fts5(
+        name, description, content,
+        content='draftin_draft', content_rowid='id', tokenize='porter unicode61')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS draftin_draft_fts_insert AFTER INSERT ON draftin_draft BEGIN
+        INSERT INTO draftin_draft_fts (rowid, name, description, content)
+        VALUES (new.id, new.name, new.description, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS draftin_draft_fts_delete AFTER DELETE ON draftin_draft BEGIN
+        INSERT INTO draftin_draft_fts (draftin_draft_fts, rowid, name, description, content)
+        VALUES ('delete', old.id, old.name, old.description, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS draftin_draft_fts_update
+    AFTER UPDATE OF name, description, content ON draftin_draft BEGIN
+        INSERT INTO draftin_draft_fts (draftin_draft_fts, rowid, name, description, content)
+        VALUES ('delete', old.id, old.name, old.description, old.content);
+        INSERT INTO draftin_draft_fts (rowid, name, description, content)
+        VALUES (new.id, new.name, new.description, new.content);
+    END
+    """,
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS draftin_draft_fts_insert",
+    "DROP TRIGGER IF EXISTS draftin_draft_fts_delete",
+    "DROP TRIGGER IF EXISTS draftin_draft_fts_update",
+    "DROP TABLE IF EXISTS draftin_draft_fts",
+]
+
+SQLITE_REBUILD = ["INSERT INTO draftin_draft_fts (draftin_draft_fts) VALUES ('rebuild')"]
+
+_backends = {}
+
+
+def has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return "ENABLE_FTS5" in [row[0] for row in cursor.fetchall()]
+
+
+def get_backend(connection=default_connection):
+    """
+    "postgresql", "sqlite", or None for the icontains fallback.
+    """
+    if connection.alias not in _backends:
+        backend = None
+        if connection.vendor == "postgresql":
+            backend = "postgresql"
+        elif connection.vendor == "sqlite":
+            tables = connection.introspection.table_names()
+            if "draftin_draft_fts" in tables:
+                backend = "sqlite"
+        _backends[connection.alias] = backend
+    return _backends[connection.alias]
+
+
+def execute(connection, statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def install(connection):
+    """
+    Create the index and its triggers, if the database supports them.
+    """
+    _backends.pop(connection.alias, None)
+    if connection.vendor == "postgresql":
+        execute(connection, POSTGRES_INSTALL)
+    elif connection.vendor == "sqlite" and has_fts5(connection):
+        execute(connection, SQLITE_INSTALL)
+
+
+def uninstall(connection):
+    _backends.pop(connection.alias, None)
+    if connection.vendor == "postgresql":
+        execute(connection, POSTGRES_UNINSTALL)
+    elif connection.vendor == "sqlite":
+        execute(connection, SQLITE_UNINSTALL)
+
+
+def rebuild(connection):
+    """
+    Reindex every draft.
+    """
+    backend = get_backend(connection)
+    if backend == "postgresql":
+        execute(connection, POSTGRES_REBUILD)
+    elif backend == "sqlite":
+        execute(connection, SQLITE_REBUILD)
+    return backend
+
+
+def search(queryset, query):
+    """
+    Drafts in queryset matching every word of query, best first,
+    annotated with search_rank.
+    """
+    words = WORD_RE.findall(query)
+    if not words:
+        return queryset.none()
+
+    backend = get_backend(connections[queryset.db])
+    if backend == "postgresql":
+        tsquery = "plainto_tsquery('%s', %%s)" % SEARCH_CONFIG
+        return queryset.annotate(search_rank=RawSQL(
+            "ts_rank_cd(search_vector, %s)" % tsquery, (query,), output_field=FloatField())
+        ).extra(where=["search_vector @@ %s" % tsquery], params=[query]
+        ).order_by("-search_rank")
+
+    if backend == "sqlite":
+        # Quoted, so punctuation in the query isn't read as FTS5 syntax
+        match = " ".join('"%s"' % word for word in words)
+        return queryset.extra(
+            tables=["draftin_draft_fts"],
+            where=["draftin_draft_fts.rowid = draftin_draft.id",
+                "draftin_draft_fts MATCH %s"],
+            params=[match],
+            select={"search_rank": "-bm25(draftin_draft_fts, 10.0, 5.0, 1.0)"},
+        ).order_by("-search_rank")
+
+    for word in words:
+        queryset = queryset.filter(Q(name__icontains=word) |
+            Q(description__icontains=word) | Q(content__icontains=word))
+    return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())
+        ).order_by("-date_published")
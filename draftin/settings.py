@@ -2,6 +2,88 @@ from django.conf import settings
 
 DRAFTIN_SETTINGS = {
     "MAX_IMAGE_SIZE": [900, 1000],
+
+    # Narrower copies of each image to list in its srcset, extra
+    # formats to offer through <picture>, and the sizes attribute.
+    "IMAGE_WIDTHS": [480, 720],
+    "IMAGE_FORMATS": ["WEBP"],
+    "IMAGE_SIZES": "(max-width: 900px) 100vw, 900px",
+
+    # Processes to resize images in (0 to resize in the downloading
+    # thread). None is one per core in draftin_worker, and 0 elsewhere.
+    "RESIZE_PROCESSES": None,
+
+    # Images larger than this many bytes aren't downloaded.
+    "MAX_IMAGE_BYTES": 20 * 1024 * 1024,
+
+    # How many images to download at once, and the
+    # size of the connection pool kept for each host.
+    "IMAGE_FETCH_CONCURRENCY": 4,
+    "GIST_FETCH_CONCURRENCY": 4,
+
+    # Seconds to wait on api calls before giving up.
+    "HTTP_TIMEOUT": 10,
+
+    # Connection limit for the shared client in draftin.aio.
+    "ASYNC_MAX_CONNECTIONS": 100,
+
+    # Used to estimate Draft.reading_time.
+    "WORDS_PER_MINUTE": 250,
+
+    # Dotted path of the class that turns markdown into html. The
+    # alternatives, draftin.rendering.MistuneRenderer (needs mistune 3)
+    # and draftin.rendering.MarkdownItRenderer (needs markdown-it-py and
+    # mdit-py-plugins), are faster. Check them against your drafts with
+    # `manage.py draftin_compare_renderers` before switching.
+    "RENDERER": "draftin.rendering.MarkdownRenderer",
+
+    # Rendered markdown is cached in this Django cache alias
+    # (None to disable), behind an in-process LRU of this size.
+    "RENDER_CACHE": "default",
+    "RENDER_CACHE_SIZE": 256,
+    "RENDER_CACHE_TIMEOUT": 60 * 60 * 24 * 7,
+
+    # Keep the html of each top-level block of a draft in the render
+    # cache too, so re-rendering an edit only converts what changed.
+    "RENDER_BLOCKS": True,
+
+    # draftin.fragments caches what templates need from a draft (via
+    # {% draftin_render %}) in this cache alias (None to disable).
+    "FRAGMENT_CACHE": "default",
+    "FRAGMENT_CACHE_TIMEOUT": 60 * 60 * 24,
+    "EXCERPT_WORDS": 55,
+
+    # Feeds of published drafts, cached in this alias (None to disable)
+    # until a draft in them is saved. FEED_LINK is the dotted path of a
+    # function giving a draft's url on the site; items it gives no url
+    # for are left without a link.
+    "FEED_CACHE": "default",
+    "FEED_CACHE_TIMEOUT": 60 * 60,
+    "FEED_ITEMS": 20,
+    "FEED_LINK": "draftin.feeds.draft_link",
+
+    # Functions run over content_html once it's rendered, in order. Also
+    # available: "draftin.transforms.external_links", which adds
+    # EXTERNAL_LINK_ATTRIBUTES to links to hosts not in ALLOWED_HOSTS.
+    "HTML_TRANSFORMERS": [
+        "draftin.transforms.rewrite_images",
+        "draftin.transforms.lazy_images",
+        "draftin.transforms.heading_anchors",
+    ],
+    "EXTERNAL_LINK_ATTRIBUTES": {"rel": "noopener", "target": "_blank"},
+
+    # Largest webhook body accepted, after decompression.
+    "MAX_PAYLOAD_BYTES": 10 * 1024 * 1024,
+
+    # Dotted paths of classes that get timings for each sync stage,
+    # e.g. "draftin.stats.LoggingBackend" or "draftin.stats.MemoryBackend".
+    "STATS_BACKENDS": [],
+
+    # Background jobs, run by `manage.py draftin_worker`.
+    "WORKER_CONCURRENCY": 2,
+    "JOB_MAX_ATTEMPTS": 5,
+    "JOB_LEASE_SECONDS": 300,
+    "JOB_RETRY_DELAY": 60,
 }
 
 DRAFTIN_SETTINGS.update(getattr(settings, "DRAFTIN_SETTINGS", {}))
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+Timing for each stage of a sync: fetch, gists, render, images, resize.
+
+Every stage is wrapped in `timed(stage)`, which sends `stage_finished`
+and passes the numbers to the backends in DRAFTIN_SETTINGS["STATS_BACKENDS"].
+With no backends and no receivers, it doesn't read the clock.
+"""
+import logging
+import threading
+import time
+
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+from .settings import DRAFTIN_SETTINGS
+
+logger = logging.getLogger("draftin.stats")
+
+# Sent with stage, duration (seconds), bytes and items.
+stage_finished = Signal()
+
+_backends = None
+
+
+class LoggingBackend(object):
+    """
+    Log a line per stage to the "draftin.stats" logger.
+    """
+
+    def record(self, stage, duration, bytes, items):
+        logger.info("%s: %.1fms, %s bytes, %s items",
+            stage, duration * 1000, bytes, items)
+
+
+class MemoryBackend(object):
+    """
+    Keep running totals per stage, for the shell or a debug view.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def record(self, stage, duration, bytes, items):
+        with self.lock:
+            totals = self.stages.setdefault(stage, {
+                "count": 0, "duration": 0.0, "max_duration": 0.0,
+                "bytes": 0, "items": 0})
+            totals["count"] += 1
+            totals["duration"] += duration
+            totals["max_duration"] = max(totals["max_duration"], duration)
+            totals["bytes"] += bytes
+            totals["items"] += items
+
+    def summary(self):
+        with self.lock:
+            return {stage: dict(totals) for stage, totals in self.stages.items()}
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+
+
+def get_backends():
+    global _backends
+    if _backends is None:
+        _backends = [import_string(path)() for path in DRAFTIN_SETTINGS["STATS_BACKENDS"]]
+    return _backends
+
+
+def get_backend(cls):
+    """
+    The configured backend of a class, e.g. get_backend(MemoryBackend).
+    """
+    for backend in get_backends():
+        if isinstance(backend, cls):
+            return backend
+    return None
+
+
+class timed(object):
+    """
+    Time a stage of the pipeline:
+
+        with timed("render") as stage:
+            html = render_markdown(text)
+            stage.bytes = len(text)
+    """
+    __slots__ = ["stage", "bytes", "items", "start"]
+
+    def __init__(self, stage, bytes=0, items=0):
+        self.stage = stage
+        self.bytes = bytes
+        self.items = items
+        self.start = None
+
+    def __enter__(self):
+        if get_backends() or stage_finished.has_listeners():
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is None:
+            return
+        duration = time.perf_counter() - self.start
+        for backend in get_backends():
+            backend.record(self.stage, duration, self.bytes, self.items)
+        stage_finished.send(sender=None, stage=self.stage, duration=duration,
+            bytes=self.bytes, items=self.items)
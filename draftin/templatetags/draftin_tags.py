@@ -0,0 +1,22 @@
+from django import template
+
+from draftin.fragments import get_fragment, render_draft
+
+register = template.Library()
+
+
+@register.simple_tag
+def draftin_render(draft):
+    """
+    {% draftin_render draft %} outputs the draft's html.
+    """
+    return render_draft(draft)
+
+
+@register.simple_tag
+def draftin_fragment(draft):
+    """
+    {% draftin_fragment draft as fragment %} gives the
+    draft's html, excerpt and headings.
+    """
+    return get_fragment(draft)
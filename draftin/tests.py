@@ -0,0 +1,436 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from .fragments import fragment_cache_key, get_fragment
+from .images import IMAGE_DIR, make_variants, store_image
+from .jobs import finish_job, lease_job, run_job
+from .management.commands.draftin_compare_renderers import CORPUS, normalize_html
+from .models import Collection, Draft, Job
+from .rendering import (MarkdownItRenderer, MarkdownRenderer, MistuneRenderer, convert_markdown,
+    render_blocks, split_blocks)
+from .settings import DRAFTIN_SETTINGS
+
+urlpatterns = [
+    path("admin/", admin.site.urls),
+    path("draftin/", include("draftin.urls")),
+]
+
+
+def payload(draft_id, **kwargs):
+    data = {
+        "id": draft_id,
+        "name": "Draft %s" % draft_id,
+        "content": "Hello world.",
+        "content_html": "<p>Hello world.</p>",
+        "user": {"id": 1, "email": "writer@example.com"},
+        "created_at": "2013-05-23T14:11:54-05:00",
+        "updated_at": "2013-05-23T14:11:58-05:00",
+    }
+    data.update(kwargs)
+    return data
+
+
+@override_settings(ROOT_URLCONF="draftin.tests")
+class WebhookTests(TestCase):
+
+    def setUp(self):
+        self.collection = Collection.objects.create(name="Blog")
+        self.url = self.collection.get_absolute_url()
+
+    def post(self, data):
+        return self.client.post(self.url, json.dumps(data),
+            content_type="application/json")
+
+    def test_create(self):
+        response = self.post(payload(1))
+        self.assertEqual(response.status_code, 200)
+        draft = Draft.objects.get(draft_id=1)
+        self.assertEqual(draft.name, "Draft 1")
+        self.assertEqual(draft.content, "Hello world.")
+        self.assertEqual(draft.wordcount, 2)
+        self.assertTrue(draft.payload_digest)
+
+    def test_redelivery_is_a_noop(self):
+        self.post(payload(1))
+        # The collection, and the draft in a savepoint; nothing is written
+        with self.assertNumQueries(4):
+            response = self.post(payload(1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Draft.objects.count(), 1)
+
+    def test_update(self):
+        self.post(payload(1))
+        draft = Draft.objects.get(draft_id=1)
+        get_fragment(draft)
+        stale_key = fragment_cache_key(draft)
+
+        response = self.post(payload(1, content="Goodbye world.",
+            content_html="<p>Goodbye world.</p>",
+            updated_at="2013-05-24T09:00:00-05:00"))
+        self.assertEqual(response.status_code, 200)
+        updated = Draft.objects.get(draft_id=1)
+        self.assertEqual(updated.content, "Goodbye world.")
+        self.assertEqual(updated.created_at, draft.created_at)
+        self.assertGreater(updated.updated_at, draft.updated_at)
+        self.assertIsNone(caches["default"].get(stale_key))
+        self.assertEqual(get_fragment(updated)["html"], "<p>Goodbye world.</p>")
+
+
+@override_settings(ROOT_URLCONF="draftin.tests", ALLOWED_HOSTS=["testserver", "example.com"])
+class FeedTests(TestCase):
+
+    def setUp(self):
+        caches["default"].clear()
+        self.collection = Collection.objects.create(name="Blog")
+        Draft.objects.create(collection=self.collection, name="Post", draft_id=1,
+            published=True, content_html="<p>Hello.</p>")
+        self.url = reverse("draftin.collection_feed",
+            kwargs={"pk": self.collection.pk, "format": "json"})
+
+    def get(self, url, **extra):
+        return json.loads(self.client.get(url, **extra).content.decode("utf-8"))
+
+    def test_query_string_isnt_cached(self):
+        self.get(self.url + "?utm_source=spam")
+        feed = self.get(self.url)
+        self.assertEqual(feed["feed_url"], "http://testserver" + self.url)
+
+    def test_cached_per_origin(self):
+        self.get(self.url)
+        feed = self.get(self.url, secure=True, HTTP_HOST="example.com")
+        self.assertEqual(feed["home_page_url"], "https://example.com/")
+        self.assertEqual(feed["feed_url"], "https://example.com" + self.url)
+        self.assertEqual(self.get(self.url)["home_page_url"], "http://testserver/")
+
+    def test_item_links(self):
+        Draft.objects.create(collection=self.collection, name="Elsewhere", draft_id=2,
+            published=True, canonical_url="https://example.com/elsewhere/")
+        items = self.get(self.url)["items"]
+        self.assertEqual([item.get("url") for item in items],
+            ["https://example.com/elsewhere/", None])
+        atom = self.client.get(self.url.replace("json", "atom")).content.decode("utf-8")
+        self.assertEqual(atom.count('rel="alternate"'), 2)
+
+
+IMAGE = "![Photo](https://draftin.com:443/images/1.jpg)"
+
+GIST = '<script src="https://gist.github.com/someone/abc123.js"></script>'
+
+
+@override_settings(ROOT_URLCONF="draftin.tests")
+class JobTests(TestCase):
+
+    def setUp(self):
+        self.collection = Collection.objects.create(name="Blog")
+        self.url = self.collection.get_absolute_url()
+
+    def post(self, data):
+        return self.client.post(self.url, json.dumps(data),
+            content_type="application/json")
+
+    def test_queues_images(self):
+        self.post(payload(1, content=IMAGE))
+        self.assertEqual(list(Job.objects.values_list("kind", flat=True)), [Job.IMAGES])
+
+    def test_queues_gists(self):
+        self.post(payload(1, content=GIST + "\n\n" + IMAGE))
+        self.assertEqual(list(Job.objects.values_list("kind", flat=True)), [Job.GISTS])
+
+    def test_nothing_to_queue(self):
+        self.post(payload(1))
+        self.assertFalse(Job.objects.exists())
+
+    def test_stale_result_is_dropped(self):
+        self.post(payload(1, content=IMAGE))
+        job = lease_job()
+
+        # A new version arrives while the job is running
+        self.post(payload(1, content=IMAGE + "\n\nVersion 2."))
+
+        def download_images(draft):
+            draft.content = "Stored images."
+        with mock.patch.object(Draft, "download_images", download_images):
+            run_job(job)
+
+        draft = Draft.objects.get(draft_id=1)
+        self.assertEqual(draft.content, IMAGE + "\n\nVersion 2.")
+        self.assertTrue(Job.objects.filter(kind=Job.IMAGES, status=Job.PENDING).exists())
+
+    def test_result_is_saved(self):
+        self.post(payload(1, content=IMAGE))
+
+        def download_images(draft):
+            draft.content = "Stored images."
+        with mock.patch.object(Draft, "download_images", download_images):
+            job = run_job(lease_job())
+
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(Draft.objects.get(draft_id=1).content, "Stored images.")
+
+    def test_expired_lease_isnt_finished(self):
+        self.post(payload(1, content=IMAGE))
+        job = lease_job()
+
+        # The lease runs out and another worker takes the job
+        Job.objects.filter(pk=job.pk).update(leased_until=timezone.now())
+        with mock.patch("draftin.jobs.timezone.now",
+                return_value=timezone.now() + datetime.timedelta(seconds=1)):
+            other = lease_job()
+        self.assertEqual(other.pk, job.pk)
+
+        finish_job(job)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+        finish_job(other)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.DONE)
+
+    def test_scrape_keeps_admin_edits(self):
+        draft = Draft.objects.create(collection=self.collection, name="Before",
+            external_url="https://example.com/post.md")
+        Job.objects.create(draft=draft, kind=Job.SCRAPE)
+        job = lease_job()
+
+        # Renamed in the admin while the scrape runs
+        Draft.objects.filter(pk=draft.pk).update(name="After", published=True)
+
+        def download_content(draft):
+            draft.content = "Scraped."
+            draft.source_digest = "digest"
+        with mock.patch.object(Draft, "download_content", download_content):
+            run_job(job)
+
+        draft = Draft.objects.get(pk=draft.pk)
+        self.assertEqual((draft.name, draft.published), ("After", True))
+        self.assertEqual((draft.content, draft.source_digest), ("Scraped.", "digest"))
+
+    def test_rescrape_action(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(user)
+        scraped = Draft.objects.create(collection=self.collection, name="Scraped",
+            external_url="https://example.com/post.md")
+        webhooked = Draft.objects.create(collection=self.collection, name="Webhook",
+            draft_id=1)
+        self.client.post(reverse("admin:draftin_draft_changelist"), {
+            "action": "rescrape", "_selected_action": [scraped.pk, webhooked.pk]})
+        self.assertEqual(list(Job.objects.values_list("draft", "kind")),
+            [(scraped.pk, Job.SCRAPE)])
+
+
+@override_settings(ROOT_URLCONF="draftin.tests")
+class ChangelistTests(TestCase):
+    """
+    Changelists run a fixed number of queries however many rows they show.
+    """
+
+    def setUp(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(user)
+
+    def add_drafts(self, count):
+        for i in range(count):
+            collection = Collection.objects.create(name="Collection %s" % i)
+            Draft.objects.create(collection=collection, name="Draft %s" % i,
+                draft_id=i, content="word " * 100, content_html="<p>words</p>")
+
+    def assertConstantQueries(self, url):
+        self.add_drafts(2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_drafts(10)
+        with self.assertNumQueries(len(queries)):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_collection_changelist(self):
+        self.assertConstantQueries(reverse("admin:draftin_collection_changelist"))
+
+    def test_draft_changelist(self):
+        self.assertConstantQueries(reverse("admin:draftin_draft_changelist"))
+
+    def test_draft_changelist_defers_text(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("admin:draftin_draft_changelist"))
+        listing = [query["sql"] for query in queries
+            if query["sql"].startswith('SELECT "draftin_draft"."id"')]
+        self.assertTrue(listing)
+        for sql in listing:
+            self.assertNotIn('"draftin_draft"."content"', sql)
+            self.assertNotIn('"draftin_draft"."content_html"', sql)
+
+
+class VariantTests(TestCase):
+
+    def setUp(self):
+        from PIL import Image
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, "draftin/img"))
+        Image.new("RGB", (1000, 500)).save(
+            os.path.join(self.media_root, "draftin/img/photo.jpg"), "JPEG")
+
+    @mock.patch.dict(DRAFTIN_SETTINGS, {"RESIZE_PROCESSES": 1,
+        "IMAGE_WIDTHS": [480, 720], "IMAGE_FORMATS": ["WEBP"]})
+    def test_pool_sees_runtime_settings(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            variants = make_variants("draftin/img/photo.jpg")
+        self.assertEqual([(v["width"], v["type"]) for v in variants], [
+            (1000, "image/jpeg"), (480, "image/jpeg"), (720, "image/jpeg"),
+            (480, "image/webp"), (720, "image/webp"), (1000, "image/webp")])
+        for variant in variants:
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, variant["path"])))
+
+    def test_svg_has_no_variants(self):
+        with open(os.path.join(self.media_root, "draftin/img/logo.svg"), "w") as f:
+            f.write('<svg xmlns="http://www.w3.org/2000/svg"/>')
+        with override_settings(MEDIA_ROOT=self.media_root):
+            self.assertEqual(make_variants("draftin/img/logo.svg"), [])
+
+    def test_missing_image_is_retried(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            self.assertIsNone(make_variants("draftin/img/missing.jpg"))
+
+
+class StoreImageTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media_root) for name in names]
+
+    def test_bad_urls(self):
+        self.assertIsNone(store_image("ftp://example.com/photo.jpg"))
+        self.assertIsNone(store_image("http://127.0.0.1:9/photo.jpg"))
+
+    def test_failed_download_is_removed(self):
+        response = mock.MagicMock(ok=True, headers={"content-type": "image/jpeg"})
+        response.__enter__.return_value = response
+        response.iter_content.side_effect = lambda size: self.broken_stream()
+        session = mock.Mock()
+        session.get.return_value = response
+        with mock.patch("draftin.images.get_session", return_value=session):
+            self.assertIsNone(store_image("https://example.com/photo.jpg"))
+        self.assertEqual(session.get.call_args[1]["timeout"], DRAFTIN_SETTINGS["HTTP_TIMEOUT"])
+        self.assertTrue(os.path.isdir(os.path.join(self.media_root, IMAGE_DIR)))
+        self.assertEqual(self.stored_files(), [])
+
+    def broken_stream(self):
+        import requests
+        yield b"\xff\xd8 partial"
+        raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+
+class ImportTests(TestCase):
+
+    def setUp(self):
+        self.collection = Collection.objects.create(name="Blog")
+        Draft.objects.create(collection=self.collection, name="Old", draft_id=1)
+        fd, self.path = tempfile.mkstemp(suffix=".jsonl")
+        self.addCleanup(os.remove, self.path)
+        with os.fdopen(fd, "w") as f:
+            for draft_id, content in [(1, "Again."), (2, "![A](a.png)"), (2, "Repeated.")]:
+                f.write(json.dumps({"name": "Draft %s" % draft_id,
+                    "content": content, "draft_id": draft_id}) + "\n")
+
+    def test_import(self):
+        call_command("draftin_import", self.path, collection=str(self.collection.uuid),
+            processes=1, stdout=mock.Mock())
+        self.assertEqual(Draft.objects.get(draft_id=1).name, "Old")
+        draft = Draft.objects.get(draft_id=2)
+        self.assertEqual(draft.content, "![A](a.png)")
+        self.assertIn('loading="lazy"', draft.content_html)
+
+
+class RendererTests(TestCase):
+
+    def setUp(self):
+        baseline = MarkdownRenderer()
+        self.expected = {name: normalize_html(baseline.convert(text)) for name, text in CORPUS}
+
+    def get_renderer(self, cls):
+        try:
+            return cls()
+        except ImproperlyConfigured as e:
+            self.skipTest(str(e))
+
+    def assertMatchesBaseline(self, renderer):
+        for name, text in CORPUS:
+            with self.subTest(document=name):
+                self.assertEqual(normalize_html(renderer.convert(text)), self.expected[name])
+            blocks = split_blocks(text)
+            if blocks:
+                with self.subTest(document=name, by="blocks"):
+                    self.assertEqual(normalize_html("\n".join(
+                        renderer.convert(block).strip() for block in blocks)), self.expected[name])
+
+    def test_markdown_by_blocks(self):
+        self.assertMatchesBaseline(MarkdownRenderer())
+
+    def test_mistune(self):
+        self.assertMatchesBaseline(self.get_renderer(MistuneRenderer))
+
+    def test_markdown_it(self):
+        self.assertMatchesBaseline(self.get_renderer(MarkdownItRenderer))
+
+
+class BlockTests(TestCase):
+
+    def setUp(self):
+        caches[DRAFTIN_SETTINGS["RENDER_CACHE"]].clear()
+
+    def assertRendersWhole(self, text):
+        self.assertEqual(normalize_html(render_blocks(text, "test")),
+            normalize_html(convert_markdown(text)))
+
+    def test_list_split_by_blank_lines(self):
+        text = "* one\n\n* two\n\n\n* three\n\nAfter.\n"
+        self.assertEqual(len(split_blocks(text)), 2)
+        self.assertRendersWhole(text)
+
+    def test_indented_continuation(self):
+        text = "1. one\n\n    more of one\n\n        code in one\n\n2. two\n\nAfter.\n"
+        self.assertEqual(len(split_blocks(text)), 2)
+        self.assertRendersWhole(text)
+
+    def test_fence_with_blank_lines(self):
+        text = "Before.\n\n```\nfirst\n\n\n* not a list\n```\n\nAfter.\n"
+        self.assertEqual(len(split_blocks(text)), 3)
+        self.assertRendersWhole(text)
+
+    def test_blockquote(self):
+        text = "> Quoted.\n\n> Still quoted.\n\nAfter.\n"
+        self.assertEqual(len(split_blocks(text)), 2)
+        self.assertRendersWhole(text)
+
+    def test_footnotes_render_whole(self):
+        text = "A claim.[^1]\n\nMore.\n\n[^1]: The note.\n"
+        self.assertIsNone(split_blocks(text))
+        with mock.patch("draftin.rendering.convert_markdown", wraps=convert_markdown) as convert:
+            self.assertEqual(render_blocks(text, "test"), convert_markdown(text))
+        convert.assert_called_once_with(text)
+
+    def test_edit_converts_one_block(self):
+        text = "# Title\n\nFirst.\n\n* a\n* b\n\nLast.\n"
+        render_blocks(text, "test")
+        edited = text.replace("First.", "First, edited.")
+        with mock.patch("draftin.rendering.convert_markdown", wraps=convert_markdown) as convert:
+            html = render_blocks(edited, "test")
+        convert.assert_called_once_with("First, edited.")
+        self.assertEqual(normalize_html(html), normalize_html(convert_markdown(edited)))
@@ -0,0 +1,169 @@
+"""
+Post-processing for content_html.
+
+Each transformer is a function of (tree, context) that edits a shared
+lxml tree in place, so the html is parsed and serialized once however
+many are enabled in DRAFTIN_SETTINGS["HTML_TRANSFORMERS"]. The context
+holds the draft (if any) and `assets`, the stored ImageAssets by url.
+
+Of the sync pipeline's libraries, only lxml is imported here, since
+templates (through fragments) and the webhook use this module too.
+"""
+import os
+from collections import OrderedDict
+
+import lxml.html
+try:
+    import urlparse
+except ImportError:
+    from urllib import parse as urlparse
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django.utils.text import slugify
+
+from .helpers import dropbox_url
+from .settings import DRAFTIN_SETTINGS
+
+HEADINGS = ["h1", "h2", "h3", "h4", "h5", "h6"]
+
+_transformers = None
+
+
+def add_srcset(img, variants):
+    """
+    Point an <img> at the responsive copies of its image. Copies
+    in the image's own format go in its srcset; other formats go
+    in <source>s of a <picture> wrapped around it.
+    """
+    by_type = OrderedDict()
+    for variant in variants:
+        by_type.setdefault(variant["type"], []).append(variant)
+
+    def srcset(variants):
+        return ", ".join("%s %sw" % (os.path.join(settings.MEDIA_URL, v["path"]), v["width"])
+            for v in sorted(variants, key=lambda v: v["width"]))
+
+    sizes = DRAFTIN_SETTINGS["IMAGE_SIZES"]
+    own_type = variants[0]["type"]
+    if len(by_type[own_type]) > 1:
+        img.attrib["srcset"] = srcset(by_type[own_type])
+        img.attrib["sizes"] = sizes
+
+    other_types = [t for t in by_type if t != own_type]
+    if not other_types or img.getparent().tag == "picture":
+        return
+    picture = lxml.html.Element("picture")
+    picture.tail, img.tail = img.tail, None
+    img.getparent().replace(img, picture)
+    for content_type in other_types:
+        lxml.html.etree.SubElement(picture, "source", type=content_type,
+            srcset=srcset(by_type[content_type]), sizes=sizes)
+    picture.append(img)
+
+
+def rewrite_images(tree, context):
+    """
+    Point images at their stored copies, with a srcset.
+    """
+    assets = context["assets"]
+    if not assets:
+        return
+    for img in tree.iter("img"):
+        asset = assets.get(dropbox_url(img.get("src", "")))
+        if asset:
+            img.set("src", asset.file_url)
+            variants = asset.get_variants()
+            if variants:
+                add_srcset(img, variants)
+
+
+def lazy_images(tree, context):
+    """
+    Let browsers defer offscreen images and decode off the main thread.
+    """
+    for img in tree.iter("img"):
+        if "loading" not in img.attrib:
+            img.set("loading", "lazy")
+        if "decoding" not in img.attrib:
+            img.set("decoding", "async")
+
+
+def is_external(url):
+    parts = urlparse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return False
+    for host in settings.ALLOWED_HOSTS:
+        if host == parts.hostname or (host.startswith(".") and
+                ("." + parts.hostname).endswith(host)):
+            return False
+    return True
+
+
+def external_links(tree, context):
+    """
+    Add DRAFTIN_SETTINGS["EXTERNAL_LINK_ATTRIBUTES"] to links
+    off the site (hosts not in ALLOWED_HOSTS). rel is merged
+    with what the link already has.
+    """
+    attributes = DRAFTIN_SETTINGS["EXTERNAL_LINK_ATTRIBUTES"]
+    for a in tree.iter("a"):
+        if not is_external(a.get("href", "")):
+            continue
+        for name, value in attributes.items():
+            if name == "rel":
+                rel = a.get("rel", "").split()
+                value = " ".join(rel + [token for token in value.split() if token not in rel])
+            a.set(name, value)
+
+
+def heading_anchors(tree, context):
+    """
+    Give headings a unique id from their text, so they can be linked to.
+    """
+    taken = set(el.get("id") for el in tree.iter() if el.get("id"))
+    for heading in tree.iter(*HEADINGS):
+        if heading.get("id"):
+            continue
+        base = slugify(heading.text_content()) or "section"
+        anchor, n = base, 1
+        while anchor in taken:
+            n += 1
+            anchor = "%s-%s" % (base, n)
+        taken.add(anchor)
+        heading.set("id", anchor)
+
+
+def get_transformers():
+    global _transformers
+    if _transformers is None:
+        _transformers = [import_string(path) for path in DRAFTIN_SETTINGS["HTML_TRANSFORMERS"]]
+    return _transformers
+
+
+def parse_html(html):
+    return lxml.html.fragment_fromstring(html, create_parent="div")
+
+
+def serialize_html(tree):
+    """
+    The html inside the <div> parse_html() wraps the fragment in.
+    """
+    html = lxml.html.tostring(tree, encoding="unicode")
+    return html[len("<div>"):-len("</div>")]
+
+
+def transform_tree(tree, assets=None, draft=None):
+    context = {"assets": assets or {}, "draft": draft}
+    for transformer in get_transformers():
+        transformer(tree, context)
+    return tree
+
+
+def transform_html(html, assets=None, draft=None):
+    """
+    Parse html, run every transformer over it, and serialize it.
+    """
+    if not html:
+        return html
+    return serialize_html(transform_tree(parse_html(html), assets, draft))
@@ -1,6 +1,11 @@
 from django.urls import re_path
-from .views import endpoint
+from .views import endpoint, collection_feed, publication_feed
 
 urlpatterns = [
     re_path(r'^(?P<uuid>[-\w\d]+)/$', endpoint, name="draftin.endpoint"),
-]
\ No newline at end of file
+    re_path(r'^collections/(?P<pk>\d+)/feed/(?P<format>atom|json)/$', collection_feed,
+        name="draftin.collection_feed"),
+    re_path(r'^publications/(?P<pk>\d+)/feed/(?P<format>atom|json)/$', publication_feed,
+        name="draftin.publication_feed"),
+]
+
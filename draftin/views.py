@@ -1,15 +1,47 @@
 import json
+import zlib
 
-try:
-    import thread
-except ImportError:
-    import _thread as thread
-
+from django.db import transaction
 from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+
+from .feeds import build_feed, get_feed
+from .helpers import payload_digest
+from .jobs import enqueue
+from .models import GIST_RE, Collection, Draft, Job, Publication
+from .settings import DRAFTIN_SETTINGS
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+def read_payload(request):
+    """
+    Parse the webhook's JSON payload. Draftin posts it as a form
+    field, but a raw application/json body, optionally gzipped,
+    is read straight from the stream and parsed once. Bodies over
+    MAX_PAYLOAD_BYTES, before or after decompression, are refused.
+    """
+    max_bytes = DRAFTIN_SETTINGS["MAX_PAYLOAD_BYTES"]
+    if int(request.META.get("CONTENT_LENGTH") or 0) > max_bytes:
+        raise PayloadTooLarge()
+
+    if request.content_type != "application/json":
+        return json.loads(request.POST.get("payload"))
+
+    body = request.read(max_bytes + 1)
+    if len(body) > max_bytes:
+        raise PayloadTooLarge()
+    if request.META.get("HTTP_CONTENT_ENCODING", "").lower() == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = decompressor.decompress(body, max_bytes)
+        if decompressor.unconsumed_tail:
+            raise PayloadTooLarge()
+    return json.loads(body.decode("utf-8"))
 
-from .models import Collection, Draft
 
 @csrf_exempt
 def endpoint(request, uuid):
@@ -32,7 +64,9 @@ def endpoint(request, uuid):
     collection = get_object_or_404(Collection, uuid=uuid)
 
     try:
-        data = json.loads(request.POST.get("payload"))
+        data = read_payload(request)
+    except PayloadTooLarge:
+        return HttpResponse("Payload too large.", status=413)
     except Exception:
         return HttpResponseBadRequest("Something is wrong with your post.")
 
@@ -43,26 +77,81 @@ def endpoint(request, uuid):
             content_html = data["content_html"],
             draftin_user_id = data["user"]["id"],
             draftin_user_email = data["user"]["email"],
-            created_at = data["created_at"],
-            updated_at = data["updated_at"],
         )
+        # The timestamps only tell redeliveries apart; created_at and
+        # updated_at are ours (auto_now_add and auto_now)
+        digest = payload_digest(dict(parameters,
+            created_at = data["created_at"],
+            updated_at = data["updated_at"]))
         defaults = {"published": collection.auto_publish}
         defaults.update(parameters)
     except KeyError as e:
-        return HttpResponseBadRequest("%s is required" % e.message)
+        return HttpResponseBadRequest("%s is required" % e)
 
-    draft, created = Draft.objects.get_or_create(
-        draft_id=data["id"],
-        collection=collection,
-        defaults=defaults)
+    defaults["payload_digest"] = digest
 
-    if not created:
-        for key, value in parameters.items():
-            setattr(draft, key, value)
-        draft.save()
+    # Drafts with gists or images get post-processed by the job that
+    # fetches them. The gists job stores the images too.
+    has_gists = GIST_RE.search(parameters["content"]) is not None
+    has_images = "https://draftin.com:443/images/" in parameters["content"]
+    if not (has_gists or has_images):
+        from .transforms import transform_html
+        parameters["content_html"] = transform_html(parameters["content_html"])
+        defaults["content_html"] = parameters["content_html"]
 
-    if "https://draftin.com:443/images/" in draft.content:
-        thread.start_new_thread(draft.download_images, ())
+    with transaction.atomic():
+        draft, created = Draft.objects.select_for_update().get_or_create(
+            draft_id=data["id"],
+            collection=collection,
+            defaults=defaults)
+
+        if not created:
+            if draft.payload_digest == digest:
+                # Draftin redelivered something we already have
+                return HttpResponse("Thanks!")
+
+            for key, value in parameters.items():
+                setattr(draft, key, value)
+            draft.payload_digest = digest
+            draft.save(update_fields=list(parameters) + [
+                "payload_digest", "updated_at", "last_synced_at"])
+
+    if has_gists:
+        enqueue(draft, Job.GISTS)
+    elif has_images:
+        enqueue(draft, Job.IMAGES)
 
     return HttpResponse("Thanks!")
 
+
+def get_collection_feed(request, pk, format):
+    def build():
+        collection = get_object_or_404(Collection, pk=pk)
+        return build_feed(request, collection.name,
+            Draft.objects.filter(collection=collection), format)
+    return get_feed(request, "collection", pk, format, build)
+
+
+def get_publication_feed(request, pk, format):
+    def build():
+        publication = get_object_or_404(Publication, pk=pk)
+        return build_feed(request, publication.name,
+            Draft.objects.filter(publication=publication), format)
+    return get_feed(request, "publication", pk, format, build)
+
+
+def feed_view(get):
+    """
+    A view serving the feed get() returns, answering
+    conditional requests from its cached validators.
+    """
+    @condition(etag_func=lambda request, pk, format: get(request, pk, format)["etag"],
+        last_modified_func=lambda request, pk, format: get(request, pk, format)["last_modified"])
+    def view(request, pk, format):
+        feed = get(request, pk, format)
+        return HttpResponse(feed["body"], content_type=feed["content_type"])
+    return view
+
+
+collection_feed = feed_view(get_collection_feed)
+publication_feed = feed_view(get_publication_feed)